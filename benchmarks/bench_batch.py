@@ -0,0 +1,54 @@
+# benchmarks/bench_batch.py
+import os
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import cv2
+from config import Config
+from detector import Detector
+
+
+def _timeit(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return times[len(times) // 2], sum(times) / len(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение покадрового и батч-инференса Detector')
+    parser.add_argument('--image', default='samples/car_test.jpg')
+    parser.add_argument('--batch', type=int, default=4, help='число кадров (камер) в батче')
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    config = Config()
+    detector = Detector(config)
+    img = cv2.imread(args.image)
+    if img is None:
+        print(f'Error: failed to load {args.image}')
+        return
+    frames = [img.copy() for _ in range(args.batch)]
+
+    # прогрев, чтобы не мерить инициализацию
+    detector.predict(img)
+    detector.predict_batch(frames)
+
+    seq_med, seq_avg = _timeit(lambda: [detector.predict(f) for f in frames], args.repeats)
+    bat_med, bat_avg = _timeit(lambda: detector.predict_batch(frames), args.repeats)
+
+    print(f'batch support: {detector.batch_supported}, frames: {args.batch}, repeats: {args.repeats}')
+    print(f'sequential: median {seq_med * 1000:.1f} ms, mean {seq_avg * 1000:.1f} ms')
+    print(f'batched:    median {bat_med * 1000:.1f} ms, mean {bat_avg * 1000:.1f} ms')
+    print(f'speedup:    x{seq_med / bat_med:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# benchmarks/bench_inference_server.py
+import os
+import sys
+import time
+import argparse
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import cv2
+from config import Config
+from inference_server import RemoteDetector
+
+
+def _client(cfg, frames, duration, latencies, lock):
+    detector = RemoteDetector(cfg)
+    local = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        detector.predict_batch(frames)
+        local.append(time.perf_counter() - t0)
+    detector.close()
+    with lock:
+        latencies.extend(local)
+
+
+def _pct(sorted_values, q):
+    idx = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор нагрузки для сервера инференса')
+    parser.add_argument('--config', default='config/default.json')
+    parser.add_argument('--image', default='samples/car_test.jpg')
+    parser.add_argument('--clients', type=int, default=4, help='число одновременных воркеров (перекрёстков)')
+    parser.add_argument('--frames', type=int, default=4, help='кадров в одном запросе (камер)')
+    parser.add_argument('--duration', type=float, default=10.0, help='длительность замера, с')
+    args = parser.parse_args()
+
+    cfg = Config(args.config)
+    img = cv2.imread(args.image)
+    if img is None:
+        print(f'Error: failed to load {args.image}')
+        return
+    frames = [img] * args.frames
+
+    # прогрев сервера
+    warm = RemoteDetector(cfg)
+    warm.predict_batch(frames)
+    warm.close()
+
+    latencies, lock = [], threading.Lock()
+    threads = [threading.Thread(target=_client, args=(cfg, frames, args.duration, latencies, lock))
+               for _ in range(args.clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    n = len(latencies)
+    if not n:
+        print('No requests completed')
+        return
+    print(f'clients: {args.clients}, frames/request: {args.frames}, duration: {elapsed:.1f}s')
+    print(f'requests: {n}, throughput: {n / elapsed:.1f} req/s, {n * args.frames / elapsed:.1f} frames/s')
+    print(f'latency: p50 {_pct(latencies, 50) * 1000:.1f} ms, p90 {_pct(latencies, 90) * 1000:.1f} ms, '
+          f'p99 {_pct(latencies, 99) * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# benchmarks/bench_postprocess.py
+import os
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from detector import postprocess_yolo
+from postprocess_reference import postprocess_loop, make_preds
+
+
+def _median_ms(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return times[len(times) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарк постпроцессинга YOLOv5')
+    parser.add_argument('--rows', type=int, default=25200)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--nms', type=float, default=0.45)
+    args = parser.parse_args()
+    shape = (1080, 1920)
+
+    # совпадение результатов с циклом проверяет tests/test_postprocess.py
+    preds = make_preds(args.rows, 0)
+    loop_ms = _median_ms(lambda: postprocess_loop(preds, shape, args.conf, args.nms), args.repeats)
+    vec_ms = _median_ms(lambda: postprocess_yolo(preds, shape, args.conf, args.nms), args.repeats)
+    print(f'loop:       median {loop_ms:.2f} ms')
+    print(f'vectorized: median {vec_ms:.2f} ms')
+    print(f'speedup:    x{loop_ms / vec_ms:.1f}')
+
+
+if __name__ == '__main__':
+    main()
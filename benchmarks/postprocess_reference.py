@@ -0,0 +1,43 @@
+# benchmarks/postprocess_reference.py
+"""Эталонный постпроцессинг YOLOv5 и синтетические выходы сети: общие для tests/test_postprocess.py и bench_postprocess.py."""
+import cv2
+import numpy as np
+
+
+def postprocess_loop(preds, shape, conf_thres, nms_thres):
+    """Прежняя покадровая реализация (цикл по строкам): эталон для тестов и бенчмарка postprocess_yolo."""
+    h_frame, w_frame = shape
+    preds = preds.reshape(-1, preds.shape[-1])
+    boxes, confidences = [], []
+    for det in preds:
+        conf = float(det[4])
+        if conf < conf_thres:
+            continue
+        scores = det[5:]
+        class_id = int(np.argmax(scores))
+        score = float(scores[class_id])
+        if score < conf_thres or class_id != 2:
+            continue
+        cx, cy, w, h = det[0:4]
+        x = int((cx - w/2) * w_frame)
+        y = int((cy - h/2) * h_frame)
+        ww = int(w * w_frame)
+        hh = int(h * h_frame)
+        boxes.append([x, y, ww, hh])
+        confidences.append(score)
+    idxs = cv2.dnn.NMSBoxes(boxes, confidences, conf_thres, nms_thres)
+    if len(idxs) == 0:
+        return []
+    flat = [i[0] if isinstance(i, (list, tuple, np.ndarray)) else i for i in idxs]
+    return [boxes[i] for i in flat]
+
+
+def make_preds(rows, seed):
+    """Синтетический выход YOLOv5 [1, rows, 85] с небольшой долей уверенных строк."""
+    rng = np.random.default_rng(seed)
+    preds = rng.random((1, rows, 85), dtype=np.float32) * 0.3
+    preds[..., 0:4] = rng.random((1, rows, 4), dtype=np.float32) * 0.5
+    hot = rng.choice(rows, size=rows // 100, replace=False)
+    preds[0, hot, 4] = rng.uniform(0.3, 1.0, size=len(hot))
+    preds[0, hot, 5 + 2] = rng.uniform(0.3, 1.0, size=len(hot))
+    return preds
@@ -0,0 +1,289 @@
+# benchmarks/run_benchmarks.py
+"""
+Воспроизводимый бенчмарк детекции на записанных клипах.
+
+  python benchmarks/run_benchmarks.py --clip samples/test_vid.mp4 --mock-controller
+  python benchmarks/run_benchmarks.py --compare benchmarks/results/old.json benchmarks/results/new.json
+
+Секции:
+  detector     – Detector.predict на кадрах клипа (препроцессинг + инференс + постпроцессинг)
+  postprocess  – только Detector._postprocess на сырых выходах сети
+  masking      – VideoCapture.read (копия кадра с наложением маски) для четырёх камер на клипе
+  cycle        – полный do_detection_cycle (конвейер, решение, запросы к контроллеру)
+
+Для каждой секции: перцентили задержки, кадров/с, загрузка CPU процессом и пиковый RSS
+(пиковый RSS — максимум процесса с момента запуска, поэтому растёт от секции к секции).
+Результат сохраняется в JSON, чтобы сравнивать версии модели, input_size, OpenCV и т.д.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import importlib.util
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+sys.path.insert(0, SRC)
+
+import cv2
+import numpy as np
+import requests
+from config import Config
+from detector import Detector
+from video_capture import VideoCapture
+from controller_client import ControllerClient
+from decision import DecisionEngine
+from pipeline import DetectionPipeline
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CAM_IDS = ('1', '2', '3', '4')
+
+
+class ResourceMeter:
+    """Время, загрузка CPU процессом и пиковый RSS на участке кода."""
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self._wall
+        self.cpu = time.process_time() - self._cpu
+
+    def result(self) -> dict:
+        peak = None
+        if resource is not None:
+            # ru_maxrss в Linux — КБ
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return {
+            'wall_sec': self.wall,
+            'cpu_percent': self.cpu / self.wall * 100 if self.wall > 0 else 0.0,
+            'peak_rss_mb': peak,
+        }
+
+
+def latency_stats(seconds) -> dict:
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    if ms.size == 0:
+        return {}
+    return {
+        'count': int(ms.size),
+        'mean': float(ms.mean()),
+        'p50': float(np.percentile(ms, 50)),
+        'p90': float(np.percentile(ms, 90)),
+        'p99': float(np.percentile(ms, 99)),
+        'max': float(ms.max()),
+    }
+
+
+def read_clip(path, max_frames):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise SystemExit(f'No frames read from {path}')
+    return frames
+
+
+def section(times, frames_per_call, meter) -> dict:
+    result = {'latency_ms': latency_stats(times)}
+    total = sum(times)
+    result['fps'] = len(times) * frames_per_call / total if total > 0 else 0.0
+    result.update(meter.result())
+    return result
+
+
+def bench_detector(det, frames):
+    times = []
+    with ResourceMeter() as meter:
+        for f in frames:
+            t0 = time.perf_counter()
+            det.predict(f)
+            times.append(time.perf_counter() - t0)
+    return section(times, 1, meter)
+
+
+def bench_postprocess(det, frames):
+    # сырые выходы сети считаются заранее, замеряется только постпроцессинг/NMS
+    raw = []
+    for f in frames:
+        prepared = det.prepare_batch([f])
+        raw.append((det.infer_batch(prepared)[0], prepared.shapes[0]))
+    times = []
+    with ResourceMeter() as meter:
+        for preds, shape in raw:
+            t0 = time.perf_counter()
+            det._postprocess(preds, shape)
+            times.append(time.perf_counter() - t0)
+    return section(times, 1, meter)
+
+
+def bench_masking(vc, reads):
+    times = []
+    with ResourceMeter() as meter:
+        for _ in range(reads):
+            for cam_id in CAM_IDS:
+                t0 = time.perf_counter()
+                vc.read(cam_id, max_age=float('inf'))
+                times.append(time.perf_counter() - t0)
+    return section(times, 1, meter)
+
+
+def load_service(cfg):
+    """src/__main__.py как модуль (do_detection_cycle берёт shots из глобального cfg)."""
+    spec = importlib.util.spec_from_file_location('neyro_det_service', os.path.join(SRC, '__main__.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.cfg = cfg
+    return module
+
+
+def bench_cycle(cfg, vc, det, cycles):
+    service = load_service(cfg)
+    ctrl = ControllerClient(cfg)
+    pipeline = DetectionPipeline(cfg, vc, det, CAM_IDS)
+    dec = DecisionEngine(cfg)
+    log = logging.getLogger('benchmark')
+    shots = cfg.get('analysis', 'shots_per_phase')
+    times, stages = [], {}
+    try:
+        with ResourceMeter() as meter:
+            for _ in range(cycles):
+                t0 = time.perf_counter()
+                service.do_detection_cycle(pipeline, dec, ctrl, log)
+                times.append(time.perf_counter() - t0)
+                for stage, ms in pipeline.last_timings.items():
+                    stages.setdefault(stage, []).append(ms / 1000)
+        result = section(times, shots * len(CAM_IDS), meter)
+        result['stages_ms'] = {stage: latency_stats(s) for stage, s in stages.items()}
+        result['controller_ms'] = ctrl.latency_stats()
+        return result
+    finally:
+        pipeline.close()
+        ctrl.close()
+
+
+def start_mock_controller(base_url, timeout=15.0):
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'scripts', 'mock_controller.py')],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'{base_url}/program', timeout=0.5)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit('Mock controller did not start')
+
+
+def environment(cfg, det) -> dict:
+    try:
+        rev = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        rev = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_rev': rev,
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'model': det.model_path,
+        'backend': det.backend,
+        'input_size': cfg.get('detector', 'input_size'),
+        'shots_per_phase': cfg.get('analysis', 'shots_per_phase'),
+    }
+
+
+def compare(old_path, new_path):
+    """Сравнить p50 задержки и FPS двух отчётов."""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    for name, res in new['benchmarks'].items():
+        ref = old['benchmarks'].get(name)
+        if ref is None:
+            continue
+        p_old, p_new = ref['latency_ms'].get('p50', 0), res['latency_ms'].get('p50', 0)
+        change = (p_new / p_old - 1) * 100 if p_old else 0.0
+        print(f"{name:12s} p50 {p_old:8.2f} → {p_new:8.2f} ms ({change:+.1f}%), "
+              f"fps {ref['fps']:.1f} → {res['fps']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк детекции на записанных клипах')
+    parser.add_argument('--config', default='config/default.json')
+    parser.add_argument('--clip', default='samples/test_vid.mp4')
+    parser.add_argument('--frames', type=int, default=100, help='кадров клипа для detector/postprocess')
+    parser.add_argument('--mask-reads', type=int, default=50, help='чтений каждой камеры для masking')
+    parser.add_argument('--cycles', type=int, default=10, help='циклов детекции для cycle')
+    parser.add_argument('--sections', nargs='*', default=['detector', 'postprocess', 'masking', 'cycle'])
+    parser.add_argument('--mock-controller', action='store_true', help='запустить scripts/mock_controller.py')
+    parser.add_argument('--out', default=None, help='JSON-отчёт (по умолчанию benchmarks/results/<время>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='сравнить два отчёта и выйти')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    logging.basicConfig(level=logging.WARNING)
+    # все камеры читают записанный клип; кэш детекций выключен, чтобы мерить саму модель
+    cfg = Config(args.config).override({'cameras': {cam_id: args.clip for cam_id in CAM_IDS},
+                                        'cache': {'enabled': False}})
+    det = Detector(cfg)
+    det.warmup()
+    report = {'environment': environment(cfg, det), 'benchmarks': {}}
+    benchmarks = report['benchmarks']
+
+    frames = read_clip(args.clip, args.frames) if {'detector', 'postprocess'} & set(args.sections) else []
+    if 'detector' in args.sections:
+        benchmarks['detector'] = bench_detector(det, frames)
+    if 'postprocess' in args.sections:
+        benchmarks['postprocess'] = bench_postprocess(det, frames)
+
+    vc = mock = None
+    if {'masking', 'cycle'} & set(args.sections):
+        vc = VideoCapture(cfg)
+        vc.wait_ready()
+    try:
+        if 'masking' in args.sections:
+            benchmarks['masking'] = bench_masking(vc, args.mask_reads)
+        if 'cycle' in args.sections:
+            if args.mock_controller:
+                mock = start_mock_controller(cfg.get('controller', 'api_base_url'))
+            benchmarks['cycle'] = bench_cycle(cfg, vc, det, args.cycles)
+    finally:
+        if vc is not None:
+            vc.release()
+        if mock is not None:
+            mock.terminate()
+
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    with open(out, 'w', encoding='utf-8') as f:
+        f.write(text)
+    for name, res in benchmarks.items():
+        lat = res['latency_ms']
+        print(f"{name:12s} p50 {lat.get('p50', 0):8.2f} ms, p99 {lat.get('p99', 0):8.2f} ms, "
+              f"{res['fps']:7.1f} fps, cpu {res['cpu_percent']:5.0f}%, peak rss {res['peak_rss_mb']} MB")
+    print(f'Saved {out}')
+
+
+if __name__ == '__main__':
+    main()
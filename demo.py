@@ -4,7 +4,7 @@ import yaml
 import numpy as np
 import threading
 import time
-from queue import Queue
+from queue import Queue, Full, Empty
 from ultralytics import YOLO
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel,
@@ -18,6 +18,9 @@ VIDEO_PATHS = ['samples/test_vid.mp4', 'samples/test_vid.mp4']
 ZONE_FILES = ['masks/zone_1.yaml', 'masks/zone_2.yaml', 'masks/zone_3.yaml', 'masks/zone_4.yaml']
 DETECT_CLASSES = [2, 5, 7]  # COCO IDs: 2-car, 5-bus, 7-truck
 REGION_NAMES = ['Cam1|Zone1', 'Cam2|Zone1', 'Cam1|Zone2', 'Cam2|Zone2']
+MODEL_PATH = 'yolo11s.pt'
+RESULT_QUEUE_SIZE = 4  # results waiting for the GUI; older ones are dropped
+TARGET_FPS = 5  # analysis rate per camera; lowered automatically if inference is slower
 
 class MaskLoader:
     def __init__(self, file_path, frame_shape):
@@ -54,45 +57,92 @@ class MaskLoader:
     def apply(self, frame):
         return cv2.bitwise_and(frame, frame, mask=self.mask)
 
+    def contains(self, xyxy):
+        """Boolean array: which boxes (N x 4, x1 y1 x2 y2) have their centre inside the zone."""
+        if len(xyxy) == 0:
+            return np.zeros(0, dtype=bool)
+        h, w = self.mask.shape
+        cx = np.clip(((xyxy[:, 0] + xyxy[:, 2]) // 2).astype(int), 0, w - 1)
+        cy = np.clip(((xyxy[:, 1] + xyxy[:, 3]) // 2).astype(int), 0, h - 1)
+        return self.mask[cy, cx] > 0
+
+def put_latest(q, item):
+    """Put item into a bounded queue, dropping the oldest result if the GUI has fallen behind."""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except Full:
+            try:
+                q.get_nowait()
+            except Empty:
+                pass
+
 class VideoWorker(threading.Thread):
-    def __init__(self, source, masks, model, output_queue, cam_idx):
+    def __init__(self, source, masks, model_path, output_queue, cam_idx, target_fps=TARGET_FPS):
         super().__init__(daemon=True)
         self.cap = cv2.VideoCapture(source)
         ret, frame = self.cap.read()
         if not ret:
             raise RuntimeError(f"Cannot open video: {source}")
+        self.src_fps = self.cap.get(cv2.CAP_PROP_FPS) or 0
+        self.target_fps = target_fps
+        self.infer_time = 0.0  # moving average of inference time, s
+        self.rate = 0.0        # effective analysis rate, frames/s
         self.masks = masks
-        self.model = model
+        # Each worker owns its model: Ultralytics models are not safe to share between threads
+        self.model = YOLO(model_path)
         self.queue = output_queue
         self.cam_idx = cam_idx
 
+    def next_frame(self, elapsed):
+        """Skip the frames that went by during `elapsed` seconds with grab() (no decoding), then read one."""
+        skip = int(elapsed * self.src_fps) - 1 if self.src_fps > 0 else 0
+        for _ in range(skip):
+            if not self.cap.grab():
+                break
+        ret, frame = self.cap.read()
+        if not ret:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return frame if ret else None
+
     def run(self):
+        last = None
         while True:
-            ret, frame = self.cap.read()
-            if not ret:
-                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            # Analysis interval follows the target FPS, but never runs faster than inference allows
+            interval = max(1.0 / self.target_fps, self.infer_time)
+            if last is not None:
+                delay = last + interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            now = time.monotonic()
+            frame = self.next_frame(now - last if last is not None else 0)
+            if last is not None:
+                self.rate = 1.0 / max(now - last, 1e-6)
+            last = now
+            if frame is None:
                 continue
+            # One inference per frame; boxes are assigned to zones by their centre afterwards
+            t0 = time.monotonic()
+            res = self.model(frame, classes=DETECT_CLASSES, verbose=False)[0]
+            dt = time.monotonic() - t0
+            self.infer_time = dt if self.infer_time == 0 else 0.8 * self.infer_time + 0.2 * dt
+            xyxy = res.boxes.xyxy.cpu().numpy().astype(int)
+            cls_ids = res.boxes.cls.cpu().numpy().astype(int)
             results_list = []
             counts = []
             for mask in self.masks:
-                roi = mask.apply(frame)
-                res = self.model(roi)[0]
-                boxes, cnt = [], 0
-                for box in res.boxes:
-                    cls_id = int(box.cls[0])
-                    if cls_id in DETECT_CLASSES:
-                        xyxy = box.xyxy[0].cpu().numpy().astype(int)
-                        boxes.append((xyxy, cls_id))
-                        cnt += 1
-                results_list.append((roi, boxes))
-                counts.append(cnt)
-            self.queue.put((results_list, counts, self.cam_idx))
+                inside = mask.contains(xyxy)
+                boxes = list(zip(xyxy[inside], cls_ids[inside]))
+                results_list.append((mask.apply(frame), boxes))
+                counts.append(len(boxes))
+            put_latest(self.queue, (results_list, counts, self.cam_idx))
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Traffic Intersection NeuroDetector Demo")
-        self.model = YOLO('yolo11s.pt')
 
         central = QWidget()
         self.setCentralWidget(central)
@@ -122,11 +172,13 @@ class MainWindow(QMainWindow):
         self.mask_loaders = [MaskLoader(f, frame_shape) for f in ZONE_FILES]
 
         # Start video workers
-        self.queue = Queue()
+        self.queue = Queue(maxsize=RESULT_QUEUE_SIZE)
+        self.workers = []
         for idx, path in enumerate(VIDEO_PATHS):
             masks = self.mask_loaders[2*idx:2*idx+2]
-            t = VideoWorker(path, masks, self.model, self.queue, idx)
+            t = VideoWorker(path, masks, MODEL_PATH, self.queue, idx)
             t.start()
+            self.workers.append(t)
 
         # Stats history
         self.history = {i: [] for i in range(4)}
@@ -138,10 +190,21 @@ class MainWindow(QMainWindow):
         timer.start(30)
 
     def update_frame(self):
-        try:
-            results_list, counts, cam_idx = self.queue.get_nowait()
-        except:
-            return
+        # Drain everything the workers produced since the last tick; only the newest result per camera is drawn
+        latest = {}
+        while True:
+            try:
+                results_list, counts, cam_idx = self.queue.get_nowait()
+            except Empty:
+                break
+            latest[cam_idx] = results_list
+            for i, cnt in enumerate(counts):
+                self.history[2*cam_idx + i].append(cnt)
+        for cam_idx, results_list in latest.items():
+            self.show_result(results_list, cam_idx)
+        self.update_stats()
+
+    def show_result(self, results_list, cam_idx):
         for i, (roi, boxes) in enumerate(results_list):
             disp = roi.copy()
             for (xyxy, cls_id) in boxes:
@@ -161,10 +224,7 @@ class MainWindow(QMainWindow):
             painter.end()
             self.labels[2*cam_idx+i].setPixmap(pix)
 
-            # Update history
-            idx = 2*cam_idx + i
-            self.history[idx].append(counts[i])
-
+    def update_stats(self):
         # Every 5 seconds update stats panel
         now = time.time()
         if now - self.last_time >= 5:
@@ -175,6 +235,9 @@ class MainWindow(QMainWindow):
                 self.stats_list.addItem(
                     f"{REGION_NAMES[idx]} — Current: {cur}, Avg(5s): {avg:.1f}")
                 self.history[idx].clear()
+            for w in self.workers:
+                self.stats_list.addItem(
+                    f"Cam{w.cam_idx + 1} — {w.rate:.1f} fps, inference {w.infer_time * 1000:.0f} ms")
             self.last_time = now
 
 if __name__ == '__main__':
@@ -1,68 +1,197 @@
 # src/__main__.py
+import os
+import sys
 import time
+import signal
 import logging
-from config import Config
-from logger import setup_logging
+from config import Config, ConfigWatcher
+from logger import setup_logging, cycle_id
 from controller_client import ControllerClient
 from video_capture import VideoCapture
 from detector import Detector
+from inference_server import RemoteDetector
 from analyzer import average_counts
 from decision import DecisionEngine
+from pipeline import DetectionPipeline, StageTimings
+from scheduler import PhaseScheduler
+from tracker import ZoneTracker
+from metrics import REGISTRY, start_http_server
+from cycle_trace import TraceRecorder
 
-def do_detection_cycle(vc, detector, decision, ctrl, logger):
+def do_detection_cycle(pipeline, decision, ctrl, logger, tracker=None, recorder=None, status=None):
     """
     Захват N кадров, подсчёт машин, решение и смена программы.
+    С трекером вместо среднего по снимкам берётся длина очереди подтверждённых треков.
+    recorder сохраняет кадры, боксы, phase_status и решение цикла для офлайн-повтора.
     """
+    t_cycle = time.perf_counter()
     shots = cfg.get('analysis', 'shots_per_phase')
     counts_12, counts_34 = [], []
-    for _ in range(shots):
-        f1 = vc.read('1'); f2 = vc.read('2')
-        counts_12.append(len(detector.predict(f1)) + len(detector.predict(f2)))
-        f3 = vc.read('3'); f4 = vc.read('4')
-        counts_34.append(len(detector.predict(f3)) + len(detector.predict(f4)))
+    # захват/препроцессинг следующего снимка идут параллельно с инференсом текущего
+    results = pipeline.run(shots)
+    for shot, stamps in zip(results, pipeline.last_timestamps):
+        b1, b2, b3, b4 = shot
+        counts_12.append(len(b1) + len(b2))
+        counts_34.append(len(b3) + len(b4))
+        if tracker is not None:
+            # предсказание Калмана опирается на время получения кадров, а не на время разбора результатов
+            for cam_id, boxes in zip(pipeline.cam_ids, shot):
+                if stamps.get(cam_id) is not None:
+                    tracker.update(cam_id, boxes, stamps[cam_id])
 
-    avg_12 = average_counts(counts_12)
-    avg_34 = average_counts(counts_34)
+    if tracker is not None:
+        zones = tracker.report()
+        queue = {cam_id: zones.get(cam_id, {}).get('queue', 0) for cam_id in pipeline.cam_ids}
+        avg_12 = queue['1'] + queue['2']
+        avg_34 = queue['3'] + queue['4']
+        logger.info("Zones: " + ", ".join(
+            f"{z}: queue={s['queue']} +{s['arrivals']} -{s['departures']}" for z, s in zones.items()))
+    else:
+        avg_12 = average_counts(counts_12)
+        avg_34 = average_counts(counts_34)
     prog = ctrl.get_current_program()
     new_prog = decision.decide(prog, avg_12, avg_34)
 
     if new_prog != prog:
         ctrl.set_program(new_prog)
+        REGISTRY.counter('program_switches_total', help_text='Смены программы контроллера').inc()
 
+    # цикл должен уложиться в traffic_phase_lead_sec до конца фазы
+    cycle_sec = time.perf_counter() - t_cycle
+    if recorder is not None:
+        # кодирование и запись выполняет фоновый поток записи трассы
+        recorder.record(pipeline.cam_ids, pipeline.last_frames, results, status, prog, new_prog, avg_12, avg_34)
+    lead = cfg.get('controller', 'traffic_phase_lead_sec')
+    REGISTRY.histogram('cycle_seconds', help_text='Длительность цикла детекции').observe(cycle_sec)
+    REGISTRY.gauge('cycle_lead_seconds', help_text='traffic_phase_lead_sec').set(lead)
+    if cycle_sec > lead:
+        REGISTRY.counter('cycle_overruns_total', help_text='Циклы дольше traffic_phase_lead_sec').inc()
+        logger.warning(f"Cycle took {cycle_sec:.2f}s, longer than traffic_phase_lead_sec={lead}s")
+
+    if pipeline.last_zone_counts:
+        zone_avg, group_avg = {}, {}
+        for shot in pipeline.last_zone_counts:
+            for cam_id, counts in shot.items():
+                for zone_id, n in counts['zones'].items():
+                    zone_avg.setdefault(f"{cam_id}/{zone_id}", []).append(n)
+                for group_id, n in counts['groups'].items():
+                    group_avg.setdefault(f"{cam_id}/{group_id}", []).append(n)
+        logger.info("Zone counts: " + ", ".join(
+            f"{name}={average_counts(ns):.1f}" for name, ns in zone_avg.items()) + "; groups: " + ", ".join(
+            f"{name}={average_counts(ns):.1f}" for name, ns in group_avg.items()))
     logger.info(f"Cycle complete: prog={prog}, avg12={avg_12:.1f}, avg34={avg_34:.1f}, new={new_prog}")
+    logger.info("Cycle timings, ms: " + ", ".join(
+        f"{stage}={ms:.1f}" for stage, ms in pipeline.last_timings.items()))
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if pipeline.gate is not None:
+        logger.debug("Motion gate, skipped/checked: " + ", ".join(
+            f"{cam_id}={s['skipped']}/{s['checked']}" for cam_id, s in pipeline.gate.stats().items()))
+    for endpoint, stats in ctrl.latency_stats().items():
+        logger.debug(f"Controller {endpoint}: n={stats['count']}, p50={stats['p50_ms']:.0f}ms, "
+                     f"p99={stats['p99_ms']:.0f}ms, max={stats['max_ms']:.0f}ms")
+
+# Параметры, которые применяются на лету; остальные изменения требуют перезапуска
+HOT_KEYS = (
+    'detector.confidence_threshold', 'detector.nms_threshold', 'detector.classes',
+    'detector.score_fusion', 'detector.class_agnostic_nms',
+    'analysis.shots_per_phase', 'analysis.congestion_threshold', 'analysis.downgrade_cycles',
+)
+
+def apply_changes(changed, det, decision, vc, logger):
+    """
+    Применить изменения файлов, накопленные ConfigWatcher: вызывается между циклами.
+    Новый конфиг проверяется и подменяется целиком; при ошибке остаётся прежний.
+    """
+    config_path = os.path.abspath(cfg.path)
+    if config_path in changed:
+        try:
+            keys = cfg.reload()
+        except Exception as e:
+            logger.error(f"Config reload rejected, keeping previous config: {e}")
+        else:
+            if keys:
+                logger.info(f"Config reloaded: {', '.join(sorted(keys))}")
+                det.update_params(cfg)
+                decision.update_params(cfg)
+            restart = sorted(k for k in keys if k not in HOT_KEYS)
+            if restart:
+                logger.warning(f"Changes require restart to take effect: {', '.join(restart)}")
+    files = changed - {config_path}
+    if files:
+        vc.reload_masks(files)
 
 if __name__ == '__main__':
+    startup = StageTimings()
+    t0 = time.perf_counter()
+
     # Загрузка конфига и логгера
     cfg = Config()
     setup_logging(cfg)
     log = logging.getLogger()
+    if cfg.get('metrics', 'enabled', default=False):
+        start_http_server(cfg.get('metrics', 'port', default=9108), cfg.get('metrics', 'host', default='0.0.0.0'))
+    startup.add('config', time.perf_counter() - t0)
 
-    # Инициализация модулей
-    ctrl = ControllerClient(cfg)
+    # Инициализация модулей; камеры открываются в фоне параллельно с загрузкой модели
+    t_cams = time.perf_counter()
     vc = VideoCapture(cfg)
-    det = Detector(cfg)
+    ctrl = ControllerClient(cfg)
+    t1 = time.perf_counter()
+    # при включённом общем сервере инференса модель в этом процессе не загружается
+    det = RemoteDetector(cfg) if cfg.get('inference_server', 'enabled', default=False) else Detector(cfg)
+    startup.add('model_load', time.perf_counter() - t1)
+    t1 = time.perf_counter()
+    det.warmup()
+    startup.add('warmup', time.perf_counter() - t1)
+    cams_ready = vc.wait_ready()
+    startup.add('camera_open', time.perf_counter() - t_cams)
     dec = DecisionEngine(cfg)
+    pipeline = DetectionPipeline(cfg, vc, det)
+    scheduler = PhaseScheduler(cfg, ctrl)
+    tracker = ZoneTracker(cfg) if cfg.get('tracker', 'enabled', default=False) else None
+    watcher = None
+    if cfg.get('hot_reload', 'enabled', default=False):
+        watcher = ConfigWatcher(cfg, (cfg.get('mask_dir'), cfg.get('zone_dir', default=cfg.get('mask_dir'))),
+                                cfg.get('hot_reload', 'poll_interval_sec', default=1.0))
+        watcher.start()
+    recorder = None
+    if cfg.get('trace', 'enabled', default=False):
+        recorder = TraceRecorder(cfg)
+        pipeline.keep_frames = True
+    startup.add('total', time.perf_counter() - t0)
 
-    lead = cfg.get('controller', 'traffic_phase_lead_sec', default=2)
+    log.info("Startup timings, ms: " + ", ".join(
+        f"{stage}={ms:.0f}" for stage, ms in startup.as_ms().items()))
+    log.info("Cameras ready, ms: " + ", ".join(
+        f"{cam_id}={sec * 1000:.0f}" if sec is not None else f"{cam_id}=timeout"
+        for cam_id, sec in cams_ready.items()))
     log.info("Starting neyro_det service...")
+    # SIGTERM (systemd, docker stop) завершает сервис через finally: дописываются трасса и логи
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     try:
+        cycle = 0
         while True:
-            status = ctrl.get_phase_status()
-            prog = status['program']
-            phase = status['phase']
-            time_left = status['time_left']
-            log.info(f"Checking object phase...\nphase={phase}, time_left={time_left:.1f}s")
-            log.debug(f"Prog={prog}, phase={phase}, time_left={time_left:.1f}s")
-
-            # Когда до конца зелёного остаётся <= lead и после этой фазы включается красный
-            if phase in (0, 1) and time_left <= lead:
-                print('1')
-                do_detection_cycle(vc, det, dec, ctrl, log)
-                # чтобы не повторяться в одной фазе
-                time.sleep(lead + 0.1)
-            else:
-                time.sleep(0.2)
+            # изменения конфига, масок и зон применяются после цикла, до ожидания следующей фазы:
+            # не в окне traffic_phase_lead_sec, в которое должен уложиться цикл
+            if watcher is not None:
+                changed = watcher.take()
+                if changed:
+                    apply_changes(changed, det, dec, vc, log)
+            # Когда до конца зелёного остаётся lead секунд и после этой фазы включается красный
+            status = scheduler.wait_for_trigger()
+            cycle += 1
+            cycle_id.set(cycle)
+            do_detection_cycle(pipeline, dec, ctrl, log, tracker, recorder, status)
 
     except KeyboardInterrupt:
         log.info("Shutting down neyro_det service")
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        if recorder is not None:
+            recorder.close()
+        pipeline.close()
+        vc.release()
+        ctrl.close()
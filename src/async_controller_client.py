@@ -0,0 +1,98 @@
+import time
+import asyncio
+import logging
+from config import Config
+from metrics import LatencyHistogram, REGISTRY
+
+# aiohttp нужен только асинхронному запуску нескольких перекрёстков
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+class AsyncControllerClient:
+    """
+    Асинхронный аналог ControllerClient на aiohttp для многоперекрёстного сервиса.
+    Один ClientSession с keep-alive на перекрёсток, повторы с экспоненциальной задержкой
+    (POST — только при ошибке соединения), таймауты и гистограммы задержек по эндпоинтам.
+    """
+    def __init__(self, config: Config):
+        if aiohttp is None:
+            raise RuntimeError("Для асинхронного клиента контроллера требуется aiohttp.")
+        self._base = config.get('controller', 'api_base_url')
+        self._timeout = config.get('controller', 'http_timeout', default=2)
+        self._timeouts = config.get('controller', 'timeouts', default={}) or {}
+        self._retries = config.get('controller', 'retries', default=2)
+        self._backoff = config.get('controller', 'retry_backoff_sec', default=0.1)
+        self._pool_size = config.get('controller', 'pool_size', default=4)
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._latency = {}
+        self._session = None
+
+    async def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._pool_size)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def _request(self, method: str, endpoint: str, **kwargs):
+        session = await self._get_session()
+        url = f"{self._base}/{endpoint}"
+        timeout = aiohttp.ClientTimeout(total=self._timeouts.get(endpoint, self._timeout))
+        key = f"{method} {endpoint}"
+        hist = self._latency.setdefault(key, LatencyHistogram())
+        rtt = REGISTRY.histogram('controller_rtt_seconds', {'method': method, 'endpoint': endpoint},
+                                 'Время запроса к контроллеру')
+        for attempt in range(self._retries + 1):
+            t0 = time.perf_counter()
+            try:
+                async with session.request(method, url, timeout=timeout, **kwargs) as r:
+                    if r.status >= 500 and attempt < self._retries:
+                        raise aiohttp.ClientResponseError(
+                            r.request_info, r.history, status=r.status, message=r.reason)
+                    r.raise_for_status()
+                    return await r.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # POST /program перезапускает фазу: повторяем его, только если запрос не ушёл
+                retryable = method == 'GET' or isinstance(e, aiohttp.ClientConnectorError)
+                if attempt >= self._retries or not retryable:
+                    raise
+                self._log.debug("%s failed (%s), retry %d/%d", key, e, attempt + 1, self._retries)
+                await asyncio.sleep(self._backoff * (2 ** attempt))
+            finally:
+                elapsed = time.perf_counter() - t0
+                hist.observe(elapsed)
+                rtt.observe(elapsed)
+
+    async def get_current_program(self) -> int:
+        """Вернуть ID текущей программы (0–6)."""
+        try:
+            data = await self._request('GET', 'program')
+            program = data.get('program')
+            self._log.debug("Current program from controller: %s", program)
+            return int(program)
+        except Exception as e:
+            self._log.error(f"Failed to get current program: {e}")
+            raise
+
+    async def set_program(self, program_id: int) -> bool:
+        """Поменять программу на program_id. Возвращает True при успехе."""
+        try:
+            await self._request('POST', 'program', json={'program': program_id})
+            self._log.info(f"Program changed to {program_id}")
+            return True
+        except Exception as e:
+            self._log.error(f"Failed to set program to {program_id}: {e}")
+            return False
+
+    async def get_phase_status(self) -> dict:
+        """{ "program": int, "phase": int, "time_left": float }"""
+        return await self._request('GET', 'phase_status')
+
+    def latency_stats(self) -> dict:
+        return {key: hist.snapshot() for key, hist in self._latency.items()}
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -1,7 +1,16 @@
+import copy
 import json
 import os
+import logging
+import threading
 from typing import Any, Dict
 
+# inotify_simple необязателен: без него (и вне Linux) изменения файлов ищутся опросом mtime
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
 class Config:
     """
     Загрузчик конфигурации из JSON-файла.
@@ -11,11 +20,18 @@ class Config:
         self._data: Dict[str, Any] = {}
         self.load()
 
+    @property
+    def path(self) -> str:
+        return self._path
+
     def load(self) -> None:
+        """Прочитать и проверить файл; текущие данные заменяются одной операцией и только при успехе."""
         if not os.path.isfile(self._path):
             raise FileNotFoundError(f"Config file not found: {self._path}")
         with open(self._path, 'r', encoding='utf-8') as f:
-            self._data = json.load(f)
+            data = json.load(f)
+        validate(data)
+        self._data = data
 
     def get(self, *keys, default: Any = None) -> Any:
         data = self._data
@@ -26,6 +42,166 @@ class Config:
                 return default
         return data
 
-    def reload(self) -> None:
-        """Перезагрузить конфиг вручную."""
-        self.load()
\ No newline at end of file
+    def reload(self) -> set:
+        """
+        Перезагрузить конфиг. Возвращает множество изменившихся ключей вида 'detector.nms_threshold'.
+        При ошибке чтения или проверки исключение пробрасывается, а прежний конфиг остаётся в силе.
+        """
+        old = self._data
+        self.load()
+        return _diff(old, self._data)
+
+    def derive(self, *keys) -> 'Config':
+        """
+        Конфиг секции (например, одного перекрёстка): значения из секции по пути keys
+        рекурсивно перекрывают значения верхнего уровня.
+        """
+        section = self.get(*keys, default=None)
+        if not isinstance(section, dict):
+            raise KeyError(f"Config section not found: {'.'.join(map(str, keys))}")
+        return self.override(section)
+
+    def override(self, data: Dict[str, Any]) -> 'Config':
+        """Копия конфига, в которой значения data рекурсивно перекрывают текущие."""
+        derived = Config.__new__(Config)
+        derived._path = self._path
+        derived._data = _merge(self._data, data)
+        return derived
+
+
+def validate(data: Dict[str, Any]) -> None:
+    """Проверить значения, которые можно менять на лету; RuntimeError со списком ошибок."""
+    if not isinstance(data, dict):
+        raise RuntimeError("Config root must be an object")
+    errors = []
+
+    def check(section, key, ok, expected):
+        value = data.get(section, {}).get(key) if isinstance(data.get(section), dict) else None
+        if value is not None and not ok(value):
+            errors.append(f"{section}.{key}={value!r}: expected {expected}")
+
+    number = (int, float)
+    check('detector', 'confidence_threshold', lambda v: isinstance(v, number) and 0 <= v <= 1, 'number in [0, 1]')
+    check('detector', 'nms_threshold', lambda v: isinstance(v, number) and 0 <= v <= 1, 'number in [0, 1]')
+    check('detector', 'classes', lambda v: isinstance(v, list) and all(isinstance(c, int) for c in v),
+          'list of class ids')
+    check('analysis', 'shots_per_phase', lambda v: isinstance(v, int) and v >= 1, 'integer >= 1')
+    check('analysis', 'congestion_threshold', lambda v: isinstance(v, number) and v >= 0, 'number >= 0')
+    check('analysis', 'downgrade_cycles', lambda v: isinstance(v, int) and v >= 1, 'integer >= 1')
+    check('controller', 'traffic_phase_lead_sec', lambda v: isinstance(v, number) and v > 0, 'number > 0')
+    if errors:
+        raise RuntimeError("Invalid config: " + "; ".join(errors))
+
+
+def _diff(old: Any, new: Any, prefix: str = '') -> set:
+    if isinstance(old, dict) and isinstance(new, dict):
+        changed = set()
+        for key in set(old) | set(new):
+            changed |= _diff(old.get(key), new.get(key), f"{prefix}{key}.")
+        return changed
+    return set() if old == new else {prefix.rstrip('.')}
+
+
+class ConfigWatcher(threading.Thread):
+    """
+    Фоновое отслеживание файла конфига и файлов в каталогах (маски, зоны): inotify при наличии
+    inotify_simple, иначе опрос mtime раз в poll_interval секунд. Изменения только накапливаются;
+    забирает их take() между циклами детекции, поэтому новые значения применяются целиком и не посреди цикла.
+    """
+    EXTENSIONS = ('.json', '.yaml', '.yml')
+
+    def __init__(self, config: Config, dirs=(), poll_interval: float = 1.0):
+        super().__init__(name='config-watcher', daemon=True)
+        self._config_path = os.path.abspath(config.path)
+        self._dirs = sorted({os.path.abspath(d) for d in dirs if d and os.path.isdir(d)})
+        self._poll_interval = poll_interval
+        self._changed = set()
+        self._missing = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._log = logging.getLogger(self.__class__.__name__)
+
+    def _relevant(self, path: str) -> bool:
+        return path == self._config_path or (
+            os.path.dirname(path) in self._dirs and path.endswith(self.EXTENSIONS))
+
+    def _snapshot(self) -> dict:
+        files = [self._config_path]
+        for d in self._dirs:
+            try:
+                files += [os.path.join(d, name) for name in os.listdir(d)]
+            except OSError as e:
+                # удалённый или подменяемый каталог считается пустым; предупреждаем один раз
+                if d not in self._missing:
+                    self._log.warning(f"Cannot list {d} ({e}), treating it as empty")
+                    self._missing.add(d)
+                continue
+            if d in self._missing:
+                self._log.info(f"Directory {d} is available again")
+                self._missing.discard(d)
+        mtimes = {}
+        for path in files:
+            if self._relevant(path):
+                try:
+                    mtimes[path] = os.stat(path).st_mtime
+                except OSError:
+                    pass
+        return mtimes
+
+    def _mark(self, paths) -> None:
+        if paths:
+            with self._lock:
+                self._changed |= set(paths)
+
+    def run(self):
+        if INotify is not None:
+            try:
+                self._run_inotify()
+                return
+            except OSError as e:
+                self._log.warning(f"inotify unavailable ({e}), falling back to polling")
+        self._run_polling()
+
+    def _run_inotify(self):
+        inotify = INotify()
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE
+        # следим за каталогами: редакторы часто сохраняют файл через переименование
+        wds = {}
+        for d in {os.path.dirname(self._config_path)} | set(self._dirs):
+            wds[inotify.add_watch(d, mask)] = d
+        self._log.info(f"Watching {sorted(wds.values())} via inotify")
+        while not self._stop_event.is_set():
+            events = inotify.read(timeout=int(self._poll_interval * 1000))
+            self._mark([p for p in (os.path.join(wds[e.wd], e.name) for e in events) if self._relevant(p)])
+        inotify.close()
+
+    def _run_polling(self):
+        self._log.info(f"Polling {[self._config_path] + self._dirs} every {self._poll_interval}s")
+        seen = self._snapshot()
+        while not self._stop_event.wait(self._poll_interval):
+            current = self._snapshot()
+            self._mark([p for p in set(seen) | set(current) if seen.get(p) != current.get(p)])
+            seen = current
+
+    def take(self) -> set:
+        """Забрать накопленные изменённые пути (абсолютные)."""
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        return changed
+
+    @property
+    def config_path(self) -> str:
+        return self._config_path
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def _merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    result = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = _merge(result[key], value)
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
\ No newline at end of file
@@ -1,6 +1,10 @@
+import time
 import requests
 import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from config import Config
+from metrics import LatencyHistogram, REGISTRY
 
 class ControllerClient:
     """
@@ -8,21 +12,61 @@ class ControllerClient:
     Предполагаем два эндпоинта:
       GET  {base_url}/program      → текущая программа { "program": <int> }
       POST {base_url}/program      → смена программы с JSON { "program": <int> }
+    Все запросы идут через одну requests.Session с пулом keep-alive соединений
+    и повторами с экспоненциальной задержкой (POST — только при ошибке соединения);
+    задержка каждого эндпоинта пишется в гистограмму.
     """
     def __init__(self, config: Config):
         self._base = config.get('controller', 'api_base_url')
         self._timeout = config.get('controller', 'http_timeout', default=2)
+        # Таймауты по эндпоинтам, например {"phase_status": 0.5}; остальные — http_timeout
+        self._timeouts = config.get('controller', 'timeouts', default={}) or {}
         self._log = logging.getLogger(self.__class__.__name__)
+        self._latency = {}
+
+        retries = Retry(
+            total=config.get('controller', 'retries', default=2),
+            backoff_factor=config.get('controller', 'retry_backoff_sec', default=0.1),
+            status_forcelist=(500, 502, 503, 504),
+            # POST /program не идемпотентен (контроллер перезапускает фазу), поэтому после таймаута
+            # чтения или 5xx не повторяется; ошибки соединения повторяются для всех методов
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=config.get('controller', 'pool_size', default=4),
+            max_retries=retries,
+        )
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def _request(self, method: str, endpoint: str, **kwargs):
+        url = f"{self._base}/{endpoint}"
+        timeout = self._timeouts.get(endpoint, self._timeout)
+        t0 = time.perf_counter()
+        try:
+            r = self._session.request(method, url, timeout=timeout, **kwargs)
+        finally:
+            key = f"{method} {endpoint}"
+            hist = self._latency.get(key)
+            if hist is None:
+                hist = self._latency.setdefault(key, LatencyHistogram())
+            elapsed = time.perf_counter() - t0
+            hist.observe(elapsed)
+            REGISTRY.histogram('controller_rtt_seconds', {'method': method, 'endpoint': endpoint},
+                               'Время запроса к контроллеру').observe(elapsed)
+        r.raise_for_status()
+        return r
 
     def get_current_program(self) -> int:
         """Вернуть ID текущей программы (0–6)."""
-        url = f"{self._base}/program"
         try:
-            r = requests.get(url, timeout=self._timeout)
-            r.raise_for_status()
+            r = self._request('GET', 'program')
             data = r.json()
             program = data.get('program')
-            self._log.debug(f"Current program from controller: {program}")
+            self._log.debug("Current program from controller: %s", program)
             return int(program)
         except Exception as e:
             self._log.error(f"Failed to get current program: {e}")
@@ -30,23 +74,25 @@ class ControllerClient:
 
     def set_program(self, program_id: int) -> bool:
         """Поменять программу на program_id. Возвращает True при успехе."""
-        url = f"{self._base}/program"
         payload = {'program': program_id}
         try:
-            r = requests.post(url, json=payload, timeout=self._timeout)
-            r.raise_for_status()
+            self._request('POST', 'program', json=payload)
             self._log.info(f"Program changed to {program_id}")
             return True
         except Exception as e:
             self._log.error(f"Failed to set program to {program_id}: {e}")
             return False
-        
+
     def get_phase_status(self) -> dict:
         """
         Запрос к /api/phase_status, возвращает dict:
           { "program": int, "phase": int, "time_left": float }
         """
-        url = f"{self._base}/phase_status"
-        r = requests.get(url, timeout=self._timeout)
-        r.raise_for_status()
-        return r.json()
\ No newline at end of file
+        return self._request('GET', 'phase_status').json()
+
+    def latency_stats(self) -> dict:
+        """Сводка задержек по эндпоинтам: {"GET phase_status": {count, mean_ms, p50_ms, ...}}."""
+        return {key: hist.snapshot() for key, hist in self._latency.items()}
+
+    def close(self) -> None:
+        self._session.close()
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+import cv2
+import numpy as np
+from config import Config
+
+
+class TraceRecorder:
+    """
+    Запись всего, что использовал цикл детекции: кадры снимков (JPEG, при необходимости уменьшенные),
+    боксы детектора, phase_status и решение.
+
+    Формат каталога trace.dir (только дописывание):
+      chunk_000001.npz – кадры и боксы chunk_cycles циклов: c{cycle}_s{shot}_{cam}_jpg (uint8),
+                         c{cycle}_s{shot}_{cam}_boxes (float32 N×4, координаты полного кадра)
+      index.jsonl      – по строке на цикл: номер, чанк, время, phase_status, программы, средние, формы кадров.
+    Строки индекса пишутся вместе с чанком, поэтому индекс ссылается только на записанные данные.
+
+    Кодирование JPEG и запись чанков выполняет фоновый поток: record() лишь кладёт цикл в очередь
+    из queue_size элементов и не задерживает цикл детекции; если поток не успевает, цикл не записывается.
+    close() дописывает очередь и незаконченный чанк.
+    """
+    def __init__(self, config: Config):
+        self._dir = config.get('trace', 'dir', default='traces/')
+        self._chunk_cycles = config.get('trace', 'chunk_cycles', default=10)
+        self._width = config.get('trace', 'frame_width', default=640)
+        self._quality = config.get('trace', 'jpeg_quality', default=90)
+        self._log = logging.getLogger(self.__class__.__name__)
+        os.makedirs(self._dir, exist_ok=True)
+        index = read_index(self._dir)
+        self._chunk = max((e['chunk'] for e in index), default=0) + 1
+        self._cycle = max((e['cycle'] for e in index), default=0)
+        self._arrays = {}
+        self._entries = []
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=config.get('trace', 'queue_size', default=8))
+        self._writer = threading.Thread(target=self._run, name='trace-writer', daemon=True)
+        self._writer.start()
+
+    def _encode(self, frame):
+        h, w = frame.shape[:2]
+        scale = 1.0
+        if self._width and w > self._width:
+            scale = self._width / w
+            frame = cv2.resize(frame, (self._width, int(h * scale)), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self._quality])
+        if not ok:
+            raise RuntimeError("JPEG encoding failed")
+        return buf.reshape(-1), scale
+
+    def record(self, cam_ids, frames, boxes, status=None, prog=None, new_prog=None, avg_12=None, avg_34=None):
+        """
+        Поставить цикл в очередь записи: frames и boxes — списки снимков, в каждом значения
+        по камерам в порядке cam_ids. Массивы кадров не должны изменяться после вызова.
+        """
+        try:
+            self._queue.put_nowait((time.time(), cam_ids, frames, boxes, status, prog, new_prog, avg_12, avg_34))
+        except queue.Full:
+            self.dropped += 1
+            self._log.warning(f"Trace writer is behind, cycle not recorded (dropped {self.dropped})")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._add(*item)
+                if len(self._entries) >= self._chunk_cycles:
+                    self.flush()
+            except Exception as e:
+                self._log.error(f"Failed to record trace: {e}")
+        try:
+            self.flush()
+        except Exception as e:
+            self._log.error(f"Failed to write trace chunk: {e}")
+
+    def _add(self, ts, cam_ids, frames, boxes, status, prog, new_prog, avg_12, avg_34):
+        self._cycle += 1
+        shapes, scales = {}, {}
+        for s, (shot_frames, shot_boxes) in enumerate(zip(frames, boxes)):
+            for cam_id, frame, cam_boxes in zip(cam_ids, shot_frames, shot_boxes):
+                key = f"c{self._cycle}_s{s}_{cam_id}"
+                if frame is not None:
+                    self._arrays[key + '_jpg'], scales[cam_id] = self._encode(frame)
+                    shapes[cam_id] = list(frame.shape)
+                self._arrays[key + '_boxes'] = np.asarray(cam_boxes, dtype=np.float32).reshape(-1, 4)
+        status = {k: v for k, v in (status or {}).items() if isinstance(v, (int, float, str))}
+        self._entries.append({
+            'cycle': self._cycle,
+            'chunk': self._chunk,
+            'ts': ts,
+            'cams': list(cam_ids),
+            'shots': len(boxes),
+            'shapes': shapes,
+            'scales': scales,
+            'phase_status': status,
+            'program': prog,
+            'new_program': new_prog,
+            'avg_12': avg_12,
+            'avg_34': avg_34,
+        })
+
+    def flush(self) -> None:
+        """Записать накопленный чанк (вызывается из потока записи)."""
+        if not self._entries:
+            return
+        path = chunk_path(self._dir, self._chunk)
+        # JPEG уже сжат — np.savez без повторного сжатия
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **self._arrays)
+        os.replace(tmp, path)
+        with open(os.path.join(self._dir, 'index.jsonl'), 'a', encoding='utf-8') as f:
+            for entry in self._entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._log.info(f"Trace chunk {path}: {len(self._entries)} cycles")
+        self._chunk += 1
+        self._arrays = {}
+        self._entries = []
+
+    def close(self) -> None:
+        """Дождаться записи всех поставленных в очередь циклов и последнего чанка."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+
+def chunk_path(trace_dir: str, chunk: int) -> str:
+    return os.path.join(trace_dir, f"chunk_{chunk:06d}.npz")
+
+
+def read_index(trace_dir: str):
+    path = os.path.join(trace_dir, 'index.jsonl')
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class TraceReader:
+    """Последовательное чтение записанных циклов; чанк держится открытым, пока читаются его циклы."""
+    def __init__(self, trace_dir: str):
+        self._dir = trace_dir
+        self.index = read_index(trace_dir)
+        self._chunk_no = None
+        self._chunk = None
+
+    def _load(self, chunk: int):
+        if chunk != self._chunk_no:
+            if self._chunk is not None:
+                self._chunk.close()
+            self._chunk = np.load(chunk_path(self._dir, chunk))
+            self._chunk_no = chunk
+        return self._chunk
+
+    def frames(self, entry, decode: bool = True):
+        """Кадры цикла: список снимков, в каждом кадры по камерам (None, если кадра не было)."""
+        data = self._load(entry['chunk'])
+        shots = []
+        for s in range(entry['shots']):
+            shot = []
+            for cam_id in entry['cams']:
+                key = f"c{entry['cycle']}_s{s}_{cam_id}_jpg"
+                if key not in data.files:
+                    shot.append(None)
+                elif decode:
+                    shot.append(cv2.imdecode(data[key], cv2.IMREAD_COLOR))
+                else:
+                    shot.append(data[key])
+            shots.append(shot)
+        return shots
+
+    def boxes(self, entry):
+        """Записанные боксы цикла: список снимков, в каждом списки боксов по камерам."""
+        data = self._load(entry['chunk'])
+        return [[data[f"c{entry['cycle']}_s{s}_{cam_id}_boxes"].tolist() for cam_id in entry['cams']]
+                for s in range(entry['shots'])]
+
+    def close(self) -> None:
+        if self._chunk is not None:
+            self._chunk.close()
+            self._chunk = None
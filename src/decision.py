@@ -11,11 +11,18 @@ class DecisionEngine:
         self._log = logging.getLogger(self.__class__.__name__)
         self._no_congest_cycles = 0
 
+    def update_params(self, config: Config) -> None:
+        """Новые пороги из перезагруженного конфига; счётчик циклов без заторов сохраняется."""
+        self.threshold = config.get('analysis', 'congestion_threshold')
+        self.downgrade_cycles = config.get('analysis', 'downgrade_cycles')
+        self._log.info(f"Decision params updated: threshold={self.threshold}, "
+                       f"downgrade_cycles={self.downgrade_cycles}")
+
     def decide(self, current_prog, avg_12, avg_34):
         new_prog = current_prog
         congest_12 = avg_12 > self.threshold
         congest_34 = avg_34 > self.threshold
-        self._log.debug(f"Avg12={avg_12}, Avg34={avg_34}, thr={self.threshold}")
+        self._log.debug("Avg12=%s, Avg34=%s, thr=%s", avg_12, avg_34, self.threshold)
 
         # повышение
         if congest_12 and current_prog != 1:
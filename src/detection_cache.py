@@ -0,0 +1,164 @@
+import os
+import hashlib
+import contextlib
+import logging
+import threading
+import cv2
+import numpy as np
+from config import Config
+from metrics import REGISTRY
+
+# fcntl есть только в POSIX; без него кэш защищён лишь от потоков своего процесса
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = 0x4e44434332  # "NDCC2"
+HEADER = np.dtype([('magic', '<i8'), ('slots', '<i8'), ('max_boxes', '<i8'), ('clock', '<i8')])
+
+
+def slot_dtype(max_boxes: int):
+    # version нечётная, пока слот перезаписывается: читатель сверяет её до и после копирования
+    return np.dtype([('version', '<i8'), ('key', 'V16'), ('used', '<i8'), ('n', '<i4'), ('pad', '<i4'),
+                     ('boxes', '<i4', (max_boxes, 4))])
+
+
+class DetectionCache:
+    """
+    Дисковый кэш результатов детекции в memory-mapped файле, общий для нескольких процессов.
+
+    Ключ — blake2b от уменьшенного маскированного кадра, его формы и roi, смешанный с отпечатком
+    модели и порогов (fingerprint). Таблица фиксированного размера (size_mb) с открытой адресацией:
+    ключ ищется в probe соседних слотах; при вставке в заполненное окно вытесняется слот,
+    использованный раньше всех (приближённый LRU по глобальному счётчику обращений).
+    Результаты с числом боксов больше max_boxes не кэшируются.
+    Размеры таблицы входят в имя файла (detections-<slots>x<max_boxes>.bin): процессы с другими
+    size_mb/max_boxes работают со своим файлом, и отображённый чужой файл никогда не обрезается.
+    """
+    def __init__(self, config: Config, fingerprint: bytes):
+        path = config.get('cache', 'path', default='cache/detections.bin')
+        size_mb = config.get('cache', 'size_mb', default=256)
+        self._max_boxes = config.get('cache', 'max_boxes', default=128)
+        self._hash_width = config.get('cache', 'hash_width', default=160)
+        self._probe = config.get('cache', 'probe', default=8)
+        self.fingerprint = fingerprint
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._hits = REGISTRY.counter('detection_cache_hits_total', help_text='Попадания в кэш детекций')
+        self._misses = REGISTRY.counter('detection_cache_misses_total', help_text='Промахи кэша детекций')
+
+        dtype = slot_dtype(self._max_boxes)
+        slots = max(int(size_mb * 1024 * 1024 // dtype.itemsize), self._probe)
+        size = HEADER.itemsize + slots * dtype.itemsize
+        base, ext = os.path.splitext(path)
+        self._path = f"{base}-{slots}x{self._max_boxes}{ext}"
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        open(self._path, 'ab').close()
+        self._file = open(self._path, 'r+b')
+        with self._exclusive():
+            header = self._read_header()
+            if header is None:
+                # новый файл: размечается один раз, под блокировкой
+                self._file.truncate(size)
+                self._file.seek(0)
+                self._file.write(np.array([(MAGIC, slots, self._max_boxes, 0)], dtype=HEADER).tobytes())
+                self._file.flush()
+                self._log.info(f"Created detection cache {self._path}: {slots} slots, {size / 2**20:.0f} MB")
+        if header is not None and (header['magic'] != MAGIC or header['slots'] != slots
+                                   or header['max_boxes'] != self._max_boxes):
+            # файл могут держать отображённым другие процессы: обрезать его нельзя (SIGBUS у них)
+            self._file.close()
+            raise RuntimeError(f"Incompatible detection cache file {self._path}, delete it to recreate")
+        self._header = np.memmap(self._file, dtype=HEADER, mode='r+', shape=(1,))
+        self._slots = np.memmap(self._file, dtype=dtype, mode='r+', offset=HEADER.itemsize, shape=(slots,))
+        self._n = slots
+
+    def _read_header(self):
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() < HEADER.itemsize:
+            return None
+        self._file.seek(0)
+        return np.frombuffer(self._file.read(HEADER.itemsize), dtype=HEADER)[0]
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Запись в кэш: блокировка потоков процесса и flock файла между процессами."""
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def key(self, frame, roi=None) -> bytes:
+        """Ключ кадра: содержимое уменьшенного кадра + форма + roi + отпечаток модели/порогов."""
+        h, w = frame.shape[:2]
+        if w > self._hash_width:
+            frame = cv2.resize(frame, (self._hash_width, max(1, h * self._hash_width // w)),
+                               interpolation=cv2.INTER_AREA)
+        digest = hashlib.blake2b(self.fingerprint, digest_size=16)
+        digest.update(repr((h, w, tuple(roi) if roi is not None else None)).encode())
+        digest.update(np.ascontiguousarray(frame).data)
+        return digest.digest()
+
+    def _window(self, key: bytes):
+        start = int.from_bytes(key[:8], 'little') % self._n
+        return [(start + i) % self._n for i in range(self._probe)]
+
+    def get(self, key: bytes):
+        """Боксы по ключу или None."""
+        slots = self._slots
+        for idx in self._window(key):
+            version = int(slots['version'][idx])
+            if version % 2 or bytes(slots['key'][idx]) != key:
+                continue
+            boxes = slots['boxes'][idx, :int(slots['n'][idx])].tolist()
+            if int(slots['version'][idx]) != version:
+                # слот перезаписали во время чтения
+                continue
+            with self._exclusive():
+                # пока ждали блокировку, слот мог достаться другому ключу
+                if int(slots['version'][idx]) == version:
+                    slots['used'][idx] = self._tick()
+            self._hits.inc()
+            return boxes
+        self._misses.inc()
+        return None
+
+    def _tick(self) -> int:
+        """Следующее значение общего счётчика обращений; только под _exclusive()."""
+        self._header['clock'][0] += 1
+        return int(self._header['clock'][0])
+
+    def put(self, key: bytes, boxes) -> None:
+        if len(boxes) > self._max_boxes:
+            return
+        slots = self._slots
+        with self._exclusive():
+            window = self._window(key)
+            keys = [bytes(slots['key'][i]) for i in window]
+            # тот же ключ или свободный слот, иначе — давно не использованный
+            if key in keys:
+                target = window[keys.index(key)]
+            elif bytes(16) in keys:
+                target = window[keys.index(bytes(16))]
+            else:
+                target = min(window, key=lambda i: int(slots['used'][i]))
+            slots['version'][target] += 1
+            slots['key'][target] = key
+            slots['n'][target] = len(boxes)
+            if len(boxes):
+                slots['boxes'][target, :len(boxes)] = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+            slots['used'][target] = self._tick()
+            slots['version'][target] += 1
+
+    def stats(self) -> dict:
+        return {'hits': self._hits.value, 'misses': self._misses.value, 'slots': self._n}
+
+    def close(self) -> None:
+        self._slots.flush()
+        self._header = self._slots = None
+        self._file.close()
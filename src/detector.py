@@ -1,7 +1,13 @@
+import os
+import time
+import hashlib
 import cv2
 import numpy as np
 import logging
+from collections import namedtuple
 from config import Config
+from metrics import REGISTRY
+from detection_cache import DetectionCache
 
 # Попытаемся импортировать onnxruntime
 try:
@@ -9,79 +15,408 @@ try:
 except ImportError:
     ort = None
 
+# Подготовленный вход: число кадров, индексы кадров для сети, их размеры и сдвиги зон, общий blob,
+# боксы кадров, найденных в кэше детекций {i: boxes}, и ключи кэша кадров, идущих через сеть {i: key}
+PreparedBatch = namedtuple('PreparedBatch', 'count valid shapes offsets blob cached keys', defaults=(None, None))
+
+PREPROCESS_TIME = REGISTRY.histogram('detector_preprocess_seconds', help_text='Время blobFromImages')
+FORWARD_TIME = REGISTRY.histogram('detector_forward_seconds', help_text='Время прямого прохода сети')
+POSTPROCESS_TIME = REGISTRY.histogram('detector_postprocess_seconds', help_text='Время постпроцессинга/NMS кадра')
+
 class Detector:
     """
     Инференс ONNX-модели YOLOv5 для подсчёта машин на кадре.
-    Использует сначала OpenCV DNN, а при ошибке – onnxruntime.
+    Бэкенд (OpenCV DNN CUDA/CPU или onnxruntime) выбирается по конфигу и проверяется пробным инференсом.
     """
     def __init__(self, config: Config):
         model_path = config.get('detector', 'model_path')
         self._input_size = config.get('detector', 'input_size')
         self._conf_thres = config.get('detector', 'confidence_threshold')
         self._nms_thres = config.get('detector', 'nms_threshold')
+        # По умолчанию считаем только класс «car» (2)
+        self._classes = config.get('detector', 'classes', default=[2])
+        self._score_fusion = config.get('detector', 'score_fusion', default=False)
+        self._agnostic_nms = config.get('detector', 'class_agnostic_nms', default=True)
+        # Инференс только по ограничивающему прямоугольнику зоны вместо всего кадра
+        self._crop_to_zone = config.get('detector', 'crop_to_zone', default=False)
+        self._warmup_runs = config.get('detector', 'warmup_runs', default=3)
+        # прогрев батчем по числу камер, чтобы заранее выделить память под рабочую форму входа
+        self._warmup_batch = config.get('detector', 'warmup_batch', default=4)
         self._log = logging.getLogger(self.__class__.__name__)
 
-        # Пытаемся загрузить через OpenCV DNN
+        # auto – OpenCV DNN (CUDA) → onnxruntime → OpenCV DNN (CPU); opencv / onnxruntime – только указанный
+        backend = config.get('detector', 'backend', default='auto')
+        precision = config.get('detector', 'precision', default='fp32')
+        model_path, optimized = self._resolve_model(
+            model_path, precision, config.get('detector', 'use_optimized', default=True))
+        self.model_path = model_path
+        self._ort_options = config.get('detector', 'onnxruntime', default={}) or {}
+        opencv_target = config.get('detector', 'opencv_target', default='cuda')
+        opencv_threads = config.get('detector', 'opencv_threads', default=None)
+        if opencv_threads is not None:
+            cv2.setNumThreads(opencv_threads)
+
+        opencv = ['opencv-cuda', 'opencv-cpu'] if opencv_target == 'cuda' else ['opencv-cpu']
+        if backend == 'onnxruntime' or precision != 'fp32' or optimized:
+            # квантованные и оптимизированные onnxruntime модели OpenCV DNN не исполняет
+            candidates = ['onnxruntime']
+        elif backend == 'opencv':
+            candidates = opencv
+        else:
+            candidates = (['opencv-cuda'] if opencv_target == 'cuda' else []) + ['onnxruntime', 'opencv-cpu']
+
+        # Пробуем бэкенды по порядку; каждый проверяется реальным пробным инференсом
+        errors = []
+        for candidate in candidates:
+            try:
+                self._load_backend(candidate, model_path, optimized)
+                probe = self._probe()
+            except Exception as e:
+                self._log.warning(f"Бэкенд {candidate} недоступен: {e}")
+                errors.append(f"{candidate}: {e}")
+                continue
+            self._log.info(f"YOLOv5 ({model_path}) работает через {self.backend}, "
+                           f"пробный инференс {probe * 1000:.1f} мс")
+            break
+        else:
+            raise RuntimeError(f"Не удалось загрузить модель ни одним бэкендом: {'; '.join(errors)}")
+
+        self._batch_supported = self._has_dynamic_batch()
+        if not self._batch_supported:
+            self._log.info("Вход модели с фиксированным batch, predict_batch работает покадрово.")
+
+        # Кэш результатов на диске: повторный прогон тех же кадров (replay, бенчмарки) без инференса
+        self._cache = None
+        if config.get('cache', 'enabled', default=False):
+            try:
+                self._cache = DetectionCache(config, self.fingerprint())
+            except RuntimeError as e:
+                self._log.error(f"Detection cache disabled: {e}")
+
+    def update_params(self, config: Config) -> None:
+        """Применить новые пороги и классы из перезагруженного конфига без перезагрузки модели."""
+        self._conf_thres = config.get('detector', 'confidence_threshold')
+        self._nms_thres = config.get('detector', 'nms_threshold')
+        self._classes = config.get('detector', 'classes', default=[2])
+        self._score_fusion = config.get('detector', 'score_fusion', default=False)
+        self._agnostic_nms = config.get('detector', 'class_agnostic_nms', default=True)
+        if self._cache is not None:
+            # результаты со старыми порогами больше не совпадут по ключу
+            self._cache.fingerprint = self.fingerprint()
+        self._log.info(f"Detector params updated: conf={self._conf_thres}, nms={self._nms_thres}, "
+                       f"classes={self._classes}")
+
+    def fingerprint(self) -> bytes:
+        """Отпечаток модели, бэкенда и порогов: результаты с разными отпечатками в кэше не смешиваются."""
         try:
+            st = os.stat(self.model_path)
+            model = (os.path.realpath(self.model_path), st.st_size, st.st_mtime)
+        except OSError:
+            model = (self.model_path,)
+        params = (model, self.backend, self._input_size, self._conf_thres, self._nms_thres,
+                  tuple(self._classes), self._score_fusion, self._agnostic_nms, self._crop_to_zone)
+        return hashlib.blake2b(repr(params).encode(), digest_size=16).digest()
+
+    def _load_backend(self, name, model_path, optimized):
+        if name.startswith('opencv'):
+            if name == 'opencv-cuda':
+                try:
+                    devices = cv2.cuda.getCudaEnabledDeviceCount()
+                except (AttributeError, cv2.error):
+                    devices = 0
+                if devices == 0:
+                    # без этой проверки OpenCV молча откатывается на медленный CPU DNN
+                    raise RuntimeError("OpenCV собран без CUDA или нет CUDA-устройств")
             self._net = cv2.dnn.readNetFromONNX(model_path)
-            self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-            self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+            if name == 'opencv-cuda':
+                self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+                self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+            else:
+                self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+                self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
             self._using_ort = False
-            self._log.info("YOLOv5 загружен через OpenCV DNN (CUDA).")
-        except cv2.error as e:
-            self._log.warning(f"OpenCV DNN не смог импортировать ONNX ({e}).")
-            if ort is None:
-                raise RuntimeError("Требуется onnxruntime для fallback-инференса.")
-            # Загрузка через onnxruntime
-            self._session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
-            self._input_name = self._session.get_inputs()[0].name
-            self._using_ort = True
-            self._log.info("YOLOv5 загружен через onnxruntime (CPU).")
-
-    def predict(self, frame):
-        if frame is None or frame.size == 0:
+            self.backend = f"OpenCV DNN ({'CUDA' if name == 'opencv-cuda' else 'CPU'})"
+            return
+
+        if ort is None:
+            raise RuntimeError("onnxruntime не установлен")
+        requested = self._ort_options.get('providers', ['CPUExecutionProvider'])
+        available = ort.get_available_providers()
+        providers = [p for p in requested if p in available]
+        if not providers:
+            raise RuntimeError(f"нет доступных провайдеров из {requested} (доступны: {available})")
+        self._session = ort.InferenceSession(
+            model_path, sess_options=self._session_options(optimized), providers=providers)
+        self._input_name = self._session.get_inputs()[0].name
+        self._using_ort = True
+        active = self._session.get_providers()
+        if active[0] != requested[0]:
+            self._log.warning(f"onnxruntime: запрошен {requested[0]}, фактически работает {active[0]}")
+        self.backend = f"onnxruntime ({', '.join(active)})"
+
+    def _session_options(self, optimized):
+        """SessionOptions из detector.onnxruntime: потоки, режим исполнения, арена памяти, оптимизация графа."""
+        opts = self._ort_options
+        so = ort.SessionOptions()
+        # 0 — решает onnxruntime; при нескольких процессах на одном сервере потоки стоит ограничивать
+        so.intra_op_num_threads = opts.get('intra_op_threads', 0)
+        so.inter_op_num_threads = opts.get('inter_op_threads', 0)
+        if opts.get('execution_mode', 'sequential') == 'parallel':
+            so.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        else:
+            so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        so.enable_cpu_mem_arena = opts.get('cpu_mem_arena', True)
+        so.enable_mem_pattern = opts.get('mem_pattern', True)
+        levels = {
+            'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }
+        # граф, уже оптимизированный optimize_model.py, повторно не оптимизируем
+        level = 'disable' if optimized else opts.get('graph_optimization_level', 'all')
+        so.graph_optimization_level = levels[level]
+        return so
+
+    def warmup(self, runs: int = None):
+        """
+        Несколько холостых прогонов всего пути predict_batch на входе input_size,
+        чтобы первый реальный цикл не платил за холодный старт. Возвращает времена прогонов, с.
+        """
+        runs = self._warmup_runs if runs is None else runs
+        size = self._input_size
+        times = []
+        for _ in range(runs):
+            n = self._warmup_batch if self._batch_supported else 1
+            blob = np.zeros((n, 3, size, size), dtype=np.float32)
+            prepared = PreparedBatch(n, list(range(n)), [(size, size)] * n, [None] * n, blob)
+            t0 = time.perf_counter()
+            self.finish_batch(prepared, self.infer_batch(prepared))
+            times.append(time.perf_counter() - t0)
+        if times:
+            self._log.info(f"Warm-up: {runs} runs, first {times[0] * 1000:.1f} ms, last {times[-1] * 1000:.1f} ms")
+        return times
+
+    def _probe(self):
+        """Пробный инференс на нулевом входе; возвращает время в секундах."""
+        blob = np.zeros((1, 3, self._input_size, self._input_size), dtype=np.float32)
+        t0 = time.perf_counter()
+        self._forward(blob)
+        return time.perf_counter() - t0
+
+    def _resolve_model(self, model_path, precision, use_optimized):
+        """
+        Путь к варианту модели для detector.precision (см. model_variant_path).
+        Возвращает (путь, оптимизирован ли граф); при отсутствии варианта — исходная FP32-модель.
+        """
+        if use_optimized:
+            path = model_variant_path(model_path, precision, optimized=True)
+            if os.path.isfile(path):
+                return path, True
+        if precision == 'fp32':
+            return model_path, False
+        path = model_variant_path(model_path, precision)
+        if os.path.isfile(path):
+            return path, False
+        self._log.warning(
+            f"Вариант модели {precision} не найден ({path}), используется {model_path}. "
+            f"Создайте его: python src/optimize_model.py {precision}")
+        return model_path, False
+
+    @property
+    def batch_supported(self) -> bool:
+        """Поддерживает ли модель батч-инференс за один проход."""
+        return self._batch_supported
+
+    def predict(self, frame, roi=None):
+        """
+        Боксы [x, y, w, h] машин на кадре.
+        roi=(x, y, w, h) – прямоугольник зоны; в режиме crop_to_zone инференс идёт только по нему.
+        """
+        return self.predict_batch([frame], [roi])[0]
+
+    def predict_batch(self, frames, rois=None):
+        """
+        Инференс по нескольким кадрам за один проход сети (вход [N,3,H,W]).
+        Возвращает список боксов для каждого кадра; для пустых кадров — [].
+        Если вход модели имеет фиксированный batch, кадры обрабатываются по одному.
+        """
+        prepared = self.prepare_batch(frames, rois)
+        return self.finish_batch(prepared, self.infer_batch(prepared))
+
+    def prepare_batch(self, frames, rois=None):
+        """
+        Стадия 1: вырезание зон и blobFromImages. Результат передаётся в infer_batch/finish_batch.
+        При cache.enabled кадры, найденные в кэше детекций, в blob не попадают — их боксы
+        подставляет finish_batch; так кэш работает и в predict_batch, и в DetectionPipeline.
+        """
+        if rois is None:
+            rois = [None] * len(frames)
+        valid = [i for i, f in enumerate(frames) if f is not None and f.size > 0]
+        cached, keys = {}, {}
+        if self._cache is not None:
+            for i in valid:
+                key = self._cache.key(frames[i], rois[i])
+                boxes = self._cache.get(key)
+                if boxes is None:
+                    keys[i] = key
+                else:
+                    cached[i] = boxes
+            valid = [i for i in valid if i not in cached]
+        crops = [self._crop(frames[i], rois[i]) for i in valid]
+        blob = self._preprocess([image for image, _ in crops]) if crops else None
+        shapes = [image.shape[:2] for image, _ in crops]
+        offsets = [offset for _, offset in crops]
+        return PreparedBatch(len(frames), valid, shapes, offsets, blob, cached, keys)
+
+    def infer_batch(self, prepared):
+        """Стадия 2: прямой проход сети. Возвращает сырые предсказания по каждому непустому кадру."""
+        n = len(prepared.valid)
+        if n == 0:
             return []
-        # Подготовка входа
-        blob = cv2.dnn.blobFromImage(
-            frame, 1/255.0,
+        blob = prepared.blob
+        if self._batch_supported and n > 1:
+            try:
+                preds = self._forward(blob)
+            except cv2.error as e:
+                self._log.warning(f"Батч-инференс не поддерживается моделью ({e}), переходим на покадровый.")
+                self._batch_supported = False
+            else:
+                if preds.shape[0] == n:
+                    return [preds[k] for k in range(n)]
+                self._log.warning(f"Модель вернула batch={preds.shape[0]} вместо {n}, переходим на покадровый.")
+                self._batch_supported = False
+        # срезы blob по первой оси — это ровно покадровые blob'ы [1,3,H,W]
+        return [self._forward(blob[k:k+1])[0] for k in range(n)]
+
+    def finish_batch(self, prepared, preds):
+        """Стадия 3: постпроцессинг и перевод боксов в координаты полного кадра."""
+        results = [[] for _ in range(prepared.count)]
+        for i, boxes in (prepared.cached or {}).items():
+            results[i] = boxes
+        for k, i in enumerate(prepared.valid):
+            boxes = self._postprocess(preds[k], prepared.shapes[k])
+            results[i] = self._shift(boxes, prepared.offsets[k])
+            if prepared.keys and i in prepared.keys:
+                self._cache.put(prepared.keys[i], results[i])
+        return results
+
+    def _crop(self, frame, roi):
+        """Вырезать прямоугольник зоны (view без копирования); возвращает (image, (dx, dy)|None)."""
+        if not self._crop_to_zone or roi is None:
+            return frame, None
+        x, y, w, h = roi
+        if w <= 0 or h <= 0:
+            return frame, None
+        return frame[y:y+h, x:x+w], (x, y)
+
+    @staticmethod
+    def _shift(boxes, offset):
+        """Перевести боксы из координат вырезанной зоны в координаты полного кадра."""
+        if offset is None:
+            return boxes
+        dx, dy = offset
+        return [[x + dx, y + dy, w, h] for x, y, w, h in boxes]
+
+    def _preprocess(self, frames):
+        t0 = time.perf_counter()
+        blob = cv2.dnn.blobFromImages(
+            frames, 1/255.0,
             (self._input_size, self._input_size),
             swapRB=True, crop=False
         )
+        PREPROCESS_TIME.observe(time.perf_counter() - t0)
+        return blob
+
+    def _forward(self, blob):
+        t0 = time.perf_counter()
         if not self._using_ort:
             self._net.setInput(blob)
             preds = self._net.forward()
         else:
-            # onnxruntime: blob shape = [1,3,H,W], но нужен [1,H,W,3] или [1,3,H,W]?
-            # В YOLOv5 ONNX вход — [1,3,H,W]
-            input_blob = blob
-            preds = self._session.run(None, {self._input_name: input_blob})[0]
+            # В YOLOv5 ONNX вход — [N,3,H,W]
+            preds = self._session.run(None, {self._input_name: blob})[0]
+        FORWARD_TIME.observe(time.perf_counter() - t0)
+        return preds
 
-        return self._postprocess(preds, frame.shape[:2])
+    def _has_dynamic_batch(self):
+        """
+        onnxruntime: batch-размерность задана строкой/None, если она динамическая.
+        Для OpenCV DNN это выясняется при первом батч-вызове.
+        """
+        if not self._using_ort:
+            return True
+        batch_dim = self._session.get_inputs()[0].shape[0]
+        return not isinstance(batch_dim, int)
 
     def _postprocess(self, preds, shape):
-        h_frame, w_frame = shape
-        preds = preds.reshape(-1, preds.shape[-1])
-        boxes, confidences = [], []
-        for det in preds:
-            conf = float(det[4])
-            if conf < self._conf_thres:
-                continue
-            scores = det[5:]
-            class_id = int(np.argmax(scores))
-            score = float(scores[class_id])
-            # Только класс «car» (2)
-            if score < self._conf_thres or class_id != 2:
-                continue
-            cx, cy, w, h = det[0:4]
-            x = int((cx - w/2) * w_frame)
-            y = int((cy - h/2) * h_frame)
-            ww = int(w * w_frame)
-            hh = int(h * h_frame)
-            boxes.append([x, y, ww, hh])
-            confidences.append(score)
-        idxs = cv2.dnn.NMSBoxes(boxes, confidences, self._conf_thres, self._nms_thres)
-        if len(idxs) == 0:
-            return []
-        # развернём индексы в плоский список
-        flat = [i[0] if isinstance(i, (list, tuple, np.ndarray)) else i for i in idxs]
-        return [boxes[i] for i in flat]
\ No newline at end of file
+        t0 = time.perf_counter()
+        boxes = postprocess_yolo(
+            preds, shape, self._conf_thres, self._nms_thres,
+            classes=self._classes,
+            score_fusion=self._score_fusion,
+            agnostic_nms=self._agnostic_nms,
+        )
+        POSTPROCESS_TIME.observe(time.perf_counter() - t0)
+        return boxes
+
+
+def model_variant_path(model_path, precision='fp32', optimized=False):
+    """
+    models/yolov5s.onnx → models/yolov5s.int8.onnx (precision) / models/yolov5s.int8.opt.onnx (optimized).
+    """
+    stem, ext = os.path.splitext(model_path)
+    if precision != 'fp32':
+        stem = f"{stem}.{precision}"
+    if optimized:
+        stem = f"{stem}.opt"
+    return stem + ext
+
+
+def postprocess_yolo(preds, shape, conf_thres, nms_thres,
+                     classes=(2,), score_fusion=False, agnostic_nms=True):
+    """
+    Векторизованный разбор выхода YOLOv5 ([..., 85]: cx, cy, w, h, obj, 80 классов).
+    Возвращает боксы [x, y, w, h] в координатах кадра shape=(h, w) после NMS.
+
+    score_fusion  – итоговая уверенность obj×cls вместо cls.
+    agnostic_nms  – общий NMS для всех классов; иначе NMS выполняется по классам.
+    """
+    h_frame, w_frame = shape
+    preds = preds.reshape(-1, preds.shape[-1])
+    preds = preds[preds[:, 4] >= conf_thres]
+    if len(preds) == 0:
+        return []
+
+    class_ids = preds[:, 5:].argmax(axis=1)
+    scores = preds[np.arange(len(preds)), 5 + class_ids]
+    if score_fusion:
+        scores = scores * preds[:, 4]
+    keep = (scores >= conf_thres) & np.isin(class_ids, classes)
+    if not keep.any():
+        return []
+    preds, class_ids, scores = preds[keep], class_ids[keep], scores[keep]
+
+    # xywh (центр) → xy (левый верхний угол) + wh в пикселях кадра
+    cx, cy, w, h = preds[:, 0], preds[:, 1], preds[:, 2], preds[:, 3]
+    boxes = np.stack([
+        (cx - w/2) * w_frame,
+        (cy - h/2) * h_frame,
+        w * w_frame,
+        h * h_frame,
+    ], axis=1).astype(np.int32)
+
+    nms_boxes = boxes
+    if not agnostic_nms and len(classes) > 1:
+        # сдвигаем боксы разных классов так, чтобы они не пересекались
+        offset = (class_ids * (max(w_frame, h_frame) + 1)).astype(np.int32)
+        nms_boxes = boxes.copy()
+        nms_boxes[:, 0] += offset
+        nms_boxes[:, 1] += offset
+
+    idxs = cv2.dnn.NMSBoxes(nms_boxes.tolist(), scores.tolist(), conf_thres, nms_thres)
+    if len(idxs) == 0:
+        return []
+    # развернём индексы в плоский список
+    flat = np.asarray(idxs).reshape(-1)
+    return boxes[flat].tolist()
@@ -0,0 +1,228 @@
+# src/inference_server.py
+import os
+import stat
+import time
+import queue
+import logging
+import argparse
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client
+import numpy as np
+from config import Config
+from logger import setup_logging
+from detector import Detector
+
+
+# Ключ аутентификации задаёт оператор: переменная окружения имеет приоритет над inference_server.authkey
+AUTHKEY_ENV = 'NEYRO_DET_INFERENCE_AUTHKEY'
+DEFAULT_ADDRESS = 'run/inference_server.sock'
+
+
+def parse_address(address: str):
+    """'host:port' → (host, port) для TCP; иначе путь к unix-сокету."""
+    host, sep, port = str(address).rpartition(':')
+    if sep and port.isdigit():
+        return host or '127.0.0.1', int(port)
+    return address
+
+
+def load_authkey(config: Config):
+    """Ключ аутентификации соединений (bytes) или None, если оператор его не задал."""
+    key = os.environ.get(AUTHKEY_ENV) or config.get('inference_server', 'authkey', default=None)
+    return key.encode() if key else None
+
+
+class InferenceServer:
+    """
+    Локальный сервер инференса: одна прогретая модель на несколько процессов neyro_det.
+    Запросы, пришедшие в пределах coalesce_ms, склеиваются в один батч (не больше max_batch кадров)
+    и проходят через сеть одним вызовом Detector.predict_batch.
+    Запросы — pickle, поэтому по умолчанию сервер слушает unix-сокет с правами 0600;
+    на TCP он запускается только с ключом аутентификации, заданным оператором.
+    """
+    def __init__(self, config: Config):
+        self._address = parse_address(config.get('inference_server', 'address', default=DEFAULT_ADDRESS))
+        self._authkey = load_authkey(config)
+        if isinstance(self._address, tuple) and self._authkey is None:
+            raise RuntimeError(f"Inference server on TCP {self._address} requires an authkey: "
+                               f"set {AUTHKEY_ENV} or inference_server.authkey.")
+        # секция inference_server может перекрывать параметры detector (например, backend)
+        self._detector = Detector(config.derive('inference_server'))
+        self._detector.warmup()
+        self._window = config.get('inference_server', 'coalesce_ms', default=5) / 1000
+        self._max_batch = config.get('inference_server', 'max_batch', default=16)
+        self._queue = queue.Queue()
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.requests = 0
+        self.batches = 0
+        self.frames = 0
+
+    def _prepare_socket_path(self) -> None:
+        """Каталог unix-сокета и удаление сокета, оставшегося от прошлого запуска."""
+        os.makedirs(os.path.dirname(self._address) or '.', exist_ok=True)
+        try:
+            if stat.S_ISSOCK(os.lstat(self._address).st_mode):
+                os.unlink(self._address)
+        except FileNotFoundError:
+            pass
+
+    def serve_forever(self):
+        unix = not isinstance(self._address, tuple)
+        if unix:
+            self._prepare_socket_path()
+        threading.Thread(target=self._batch_loop, name='batcher', daemon=True).start()
+        with Listener(self._address, authkey=self._authkey) as listener:
+            if unix:
+                os.chmod(self._address, 0o600)
+            self._log.info(f"Inference server listening on {self._address}")
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    header = conn.recv()
+                    frames = []
+                    for meta in header['frames']:
+                        if meta is None:
+                            frames.append(None)
+                            continue
+                        shape, dtype = meta
+                        frames.append(np.frombuffer(conn.recv_bytes(), dtype=dtype).reshape(shape))
+                except (EOFError, OSError):
+                    break
+                future = Future()
+                self._queue.put((frames, header.get('rois'), future))
+                try:
+                    reply = {'boxes': future.result()}
+                except Exception as e:
+                    reply = {'error': str(e)}
+                try:
+                    conn.send(reply)
+                except OSError as e:
+                    # клиент отключился, не дождавшись ответа
+                    self._log.warning(f"Failed to send reply, closing connection: {e}")
+                    break
+
+    def _batch_loop(self):
+        while True:
+            items = [self._queue.get()]
+            n = len(items[0][0])
+            deadline = time.monotonic() + self._window
+            # добираем запросы, пришедшие в окне склейки
+            while n < self._max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                items.append(item)
+                n += len(item[0])
+
+            frames, rois = [], []
+            for item_frames, item_rois, _ in items:
+                frames.extend(item_frames)
+                rois.extend(item_rois or [None] * len(item_frames))
+            try:
+                boxes = self._detector.predict_batch(frames, rois)
+            except Exception as e:
+                self._log.error(f"Batch inference failed: {e}")
+                for _, _, future in items:
+                    future.set_exception(e)
+                continue
+
+            pos = 0
+            for item_frames, _, future in items:
+                future.set_result(boxes[pos:pos + len(item_frames)])
+                pos += len(item_frames)
+            self.requests += len(items)
+            self.batches += 1
+            self.frames += len(frames)
+            if self._log.isEnabledFor(logging.DEBUG):
+                self._log.debug(f"Batch: {len(items)} requests, {len(frames)} frames")
+
+
+class RemoteDetector:
+    """
+    Клиент InferenceServer с интерфейсом Detector: predict / predict_batch
+    и стадии для DetectionPipeline (препроцессинг и постпроцессинг выполняет сервер).
+    """
+    batch_supported = True
+
+    def __init__(self, config: Config):
+        self._address = parse_address(config.get('inference_server', 'address', default=DEFAULT_ADDRESS))
+        self._authkey = load_authkey(config)
+        self._conn = None
+        self._lock = threading.Lock()
+        self._log = logging.getLogger(self.__class__.__name__)
+
+    def predict(self, frame, roi=None):
+        return self.predict_batch([frame], [roi])[0]
+
+    def predict_batch(self, frames, rois=None):
+        metas, payloads = [], []
+        for f in frames:
+            if f is None or f.size == 0:
+                metas.append(None)
+                continue
+            f = np.ascontiguousarray(f)
+            metas.append((f.shape, f.dtype.str))
+            payloads.append(f)
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._conn = Client(self._address, authkey=self._authkey)
+                self._conn.send({'frames': metas, 'rois': rois})
+                for f in payloads:
+                    # плоский байтовый view: срез многомерного memoryview в send_bytes режет по первой оси
+                    self._conn.send_bytes(memoryview(f).cast('B'))
+                reply = self._conn.recv()
+            except (EOFError, OSError):
+                # соединение переоткроется при следующем вызове
+                self._conn = None
+                raise
+        if 'error' in reply:
+            raise RuntimeError(f"Inference server error: {reply['error']}")
+        return reply['boxes']
+
+    def warmup(self, runs: int = None):
+        """Модель прогревает сам сервер; здесь лишь устанавливаем соединение."""
+        self.predict_batch([])
+        return []
+
+    def update_params(self, config: Config) -> None:
+        # пороги детектора задаются конфигом сервера инференса
+        self._log.warning("Detector params are owned by the inference server; reload its config instead")
+
+    def prepare_batch(self, frames, rois=None):
+        return frames, rois
+
+    def infer_batch(self, prepared):
+        return self.predict_batch(*prepared)
+
+    def finish_batch(self, prepared, preds):
+        return preds
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Общий сервер инференса neyro_det')
+    parser.add_argument('--config', default='config/default.json')
+    args = parser.parse_args()
+
+    cfg = Config(args.config)
+    setup_logging(cfg)
+    try:
+        InferenceServer(cfg).serve_forever()
+    except KeyboardInterrupt:
+        logging.getLogger().info("Shutting down inference server")
@@ -1,30 +1,139 @@
+import json
+import time
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import contextvars
+import multiprocessing as mp
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from config import Config
 
+# Номер текущего цикла детекции; попадает в каждую запись (в т.ч. в JSON-логах)
+cycle_id = contextvars.ContextVar('cycle_id', default=None)
+
+_listener = None
+# записи дочерних процессов (capture.mode = "process") и поток, пересылающий их обработчикам этого процесса
+_child_queue = None
+_child_listener = None
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет в запись номер цикла (record.cycle) и, если его не передали через extra, camera=None."""
+    def filter(self, record):
+        record.cycle = cycle_id.get()
+        if not hasattr(record, 'camera'):
+            record.camera = None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: ts, level, logger, msg, cycle, camera (+ exc при исключении)."""
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'cycle': getattr(record, 'cycle', None),
+            'camera': getattr(record, 'camera', None),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class ForwardHandler(logging.Handler):
+    """Передаёт запись, пришедшую из дочернего процесса, одноимённому логгеру этого процесса."""
+    def emit(self, record):
+        logger = logging.getLogger(record.name)
+        if logger.isEnabledFor(record.levelno):
+            logger.handle(record)
+
 
 def setup_logging(config: Config) -> None:
+    """
+    Консольный и ротируемый файловый логгер на корневом логгере.
+    logging.async – запись на консоль/диск выполняет фоновый QueueListener, потоки детекции
+    лишь кладут запись в очередь; logging.json – файл в формате JSON lines.
+    """
+    global _listener
     level_name = config.get('logging', 'level', default='INFO')
     level = getattr(logging, level_name.upper(), logging.INFO)
     log_file = config.get('logging', 'file', default='neyro_det.log')
     max_bytes = config.get('logging', 'max_bytes', default=10_485_760)
     backup_count = config.get('logging', 'backup_count', default=5)
+    use_queue = config.get('logging', 'async', default=False)
+    use_json = config.get('logging', 'json', default=False)
 
     logger = logging.getLogger()
     logger.setLevel(level)
+    context = ContextFilter()
 
     # Console handler
     console = logging.StreamHandler()
     console.setLevel(level)
     console_fmt = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
     console.setFormatter(console_fmt)
-    logger.addHandler(console)
 
     # File handler
     file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
     file_handler.setLevel(level)
-    file_fmt = logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    file_fmt = JsonFormatter() if use_json else \
+        logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
     file_handler.setFormatter(file_fmt)
-    logger.addHandler(file_handler)
 
-    logger.debug("Logging initialized")
\ No newline at end of file
+    if use_queue:
+        # фильтр стоит на QueueHandler: номер цикла читается в потоке, который пишет запись
+        q = queue.SimpleQueue()
+        queue_handler = QueueHandler(q)
+        queue_handler.addFilter(context)
+        logger.addHandler(queue_handler)
+        _listener = QueueListener(q, console, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+    else:
+        for handler in (console, file_handler):
+            handler.addFilter(context)
+            logger.addHandler(handler)
+
+    logger.debug("Logging initialized")
+
+
+def child_log_queue():
+    """
+    Очередь для записей дочерних процессов. Дочерний процесс вызывает setup_child_logging(queue, level),
+    а фоновый поток этого процесса передаёт записи в его обработчики (консоль, файл, очередь logging.async).
+    """
+    global _child_queue, _child_listener
+    if _child_queue is None:
+        _child_queue = mp.Queue()
+        _child_listener = QueueListener(_child_queue, ForwardHandler())
+        _child_listener.start()
+        atexit.register(stop_logging)
+    return _child_queue
+
+
+def setup_child_logging(q, level) -> None:
+    """
+    В дочернем процессе: заменить обработчики, унаследованные при fork (очередь logging.async
+    в этом процессе никто не читает, а файл ротирует родитель), отправкой записей в q.
+    """
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = QueueHandler(q)
+    handler.addFilter(ContextFilter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+def stop_logging() -> None:
+    """Дописать записи из очередей и остановить фоновые потоки логирования."""
+    global _listener, _child_listener
+    # сначала записи дочерних процессов: они передаются в очередь основного логирования
+    if _child_listener is not None:
+        _child_listener.stop()
+        _child_listener = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,185 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограммы задержек, мс
+DEFAULT_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LatencyHistogram:
+    """
+    Лёгкая потокобезопасная гистограмма задержек с фиксированными корзинами.
+    """
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS):
+        self._bounds = tuple(buckets_ms)
+        self._counts = [0] * (len(self._bounds) + 1)  # последняя корзина — +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        ms = seconds * 1000
+        idx = bisect.bisect_left(self._bounds, ms)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += ms
+            self._count += 1
+            if ms > self._max:
+                self._max = ms
+
+    def percentile(self, q: float) -> float:
+        """Оценка перцентиля q (0–100) в мс по верхней границе корзины."""
+        with self._lock:
+            if self._count == 0:
+                return 0.0
+            rank = q / 100 * self._count
+            acc = 0
+            for idx, cnt in enumerate(self._counts):
+                acc += cnt
+                if acc >= rank and cnt:
+                    return self._bounds[idx] if idx < len(self._bounds) else self._max
+            return self._max
+
+    def snapshot(self) -> dict:
+        """Сводка: count, mean/max в мс, p50/p90/p99 и накопительные корзины."""
+        p50, p90, p99 = self.percentile(50), self.percentile(90), self.percentile(99)
+        with self._lock:
+            cumulative, acc = {}, 0
+            for bound, cnt in zip(self._bounds + (float('inf'),), self._counts):
+                acc += cnt
+                cumulative[bound] = acc
+            return {
+                'count': self._count,
+                'sum_ms': self._sum,
+                'mean_ms': self._sum / self._count if self._count else 0.0,
+                'max_ms': self._max,
+                'p50_ms': p50,
+                'p90_ms': p90,
+                'p99_ms': p99,
+                'buckets': cumulative,
+            }
+
+
+class Counter:
+    """Потокобезопасный монотонный счётчик."""
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1) -> None:
+        with self._lock:
+            self._value += n
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class Gauge:
+    """Последнее установленное значение."""
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса: гистограммы задержек, счётчики и gauge с метками.
+    histogram()/counter()/gauge() возвращают один и тот же объект для одинаковых имени и меток,
+    поэтому их можно вызывать прямо в горячем пути или один раз сохранить ссылку.
+    render() отдаёт текстовый формат Prometheus (задержки — в секундах).
+    """
+    def __init__(self):
+        self._metrics = {}   # (name, labels) → объект метрики
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _get(self, factory, name, labels, help_text):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = factory()
+                    if help_text:
+                        self._help[name] = help_text
+        return metric
+
+    def histogram(self, name: str, labels: dict = None, help_text: str = None,
+                  buckets_ms=DEFAULT_BUCKETS_MS) -> LatencyHistogram:
+        return self._get(lambda: LatencyHistogram(buckets_ms), name, labels, help_text)
+
+    def counter(self, name: str, labels: dict = None, help_text: str = None) -> Counter:
+        return self._get(Counter, name, labels, help_text)
+
+    def gauge(self, name: str, labels: dict = None, help_text: str = None) -> Gauge:
+        return self._get(Gauge, name, labels, help_text)
+
+    def snapshot(self) -> dict:
+        """{имя{метки}: значение счётчика/gauge или сводка гистограммы}."""
+        with self._lock:
+            items = list(self._metrics.items())
+        return {_series(name, labels): (m.snapshot() if isinstance(m, LatencyHistogram) else m.value)
+                for (name, labels), m in items}
+
+    def render(self) -> str:
+        with self._lock:
+            items = sorted(self._metrics.items(), key=lambda kv: kv[0])
+        lines, typed = [], set()
+        for (name, labels), m in items:
+            if name not in typed:
+                typed.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                kind = 'histogram' if isinstance(m, LatencyHistogram) else \
+                    'counter' if isinstance(m, Counter) else 'gauge'
+                lines.append(f"# TYPE {name} {kind}")
+            if isinstance(m, LatencyHistogram):
+                snap = m.snapshot()
+                for bound, acc in snap['buckets'].items():
+                    le = '+Inf' if bound == float('inf') else f"{bound / 1000:g}"
+                    lines.append(f"{_series(name + '_bucket', labels + (('le', le),))} {acc}")
+                lines.append(f"{_series(name + '_sum', labels)} {snap['sum_ms'] / 1000:.6f}")
+                lines.append(f"{_series(name + '_count', labels)} {snap['count']}")
+            else:
+                lines.append(f"{_series(name, labels)} {m.value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _series(name, labels) -> str:
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+# Общий реестр процесса: модули пишут в него метрики горячего пути
+REGISTRY = MetricsRegistry()
+
+
+def start_http_server(port: int, host: str = '0.0.0.0', registry: MetricsRegistry = REGISTRY):
+    """Отдавать registry.render() по GET /metrics в фоновом потоке; возвращает сервер."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logging.getLogger('metrics').info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,93 @@
+import threading
+import cv2
+import numpy as np
+from config import Config
+
+
+class MotionGate:
+    """
+    Дешёвый детектор изменений в зоне камеры перед инференсом.
+
+    Кадр (уже маскированный, т.е. только зона) уменьшается до width пикселей по ширине и
+    переводится в оттенки серого; он сравнивается с кадром, на котором модель запускалась в
+    последний раз. Если доля пикселей с разницей больше pixel_threshold не превышает
+    change_threshold, зона считается неизменной и переиспользуются прошлые боксы.
+    Не более max_skips пропусков подряд, чтобы медленные изменения не накапливались.
+
+    select() вызывается для снимков по порядку и сразу делает отправленный на инференс кадр эталоном,
+    поэтому следующий снимок сравнивается с ним, даже если его боксы ещё не готовы. Боксы передаются
+    в update() и забираются cached() тоже в порядке снимков.
+    """
+    def __init__(self, config: Config):
+        self._width = config.get('motion_gate', 'width', default=160)
+        self._pixel_thres = config.get('motion_gate', 'pixel_threshold', default=25)
+        self._change_thres = config.get('motion_gate', 'change_threshold', default=0.01)
+        self._max_skips = config.get('motion_gate', 'max_skips', default=10)
+        self._lock = threading.Lock()
+        self._refs = {}      # cam_id → уменьшенный серый кадр последнего отправленного на инференс
+        self._boxes = {}     # cam_id → боксы последнего инференса
+        self._skips = {}     # cam_id → пропусков подряд
+        self._checked = {}
+        self._skipped = {}
+
+    def _small(self, frame):
+        h, w = frame.shape[:2]
+        scale = self._width / w
+        small = cv2.resize(frame, (self._width, max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def change_ratio(self, ref, small) -> float:
+        """Доля изменившихся пикселей зоны (чёрные замаскированные пиксели не учитываются)."""
+        area = np.count_nonzero((ref > 0) | (small > 0))
+        if area == 0:
+            return 0.0
+        diff = cv2.absdiff(ref, small)
+        return np.count_nonzero(diff > self._pixel_thres) / area
+
+    def select(self, cam_ids, frames):
+        """
+        Отобрать кадры, которым нужен инференс.
+        Возвращает (frames для инференса с None вместо пропущенных, множество индексов пропущенных).
+        """
+        to_infer, skipped = list(frames), set()
+        with self._lock:
+            for i, (cam_id, frame) in enumerate(zip(cam_ids, frames)):
+                if frame is None:
+                    continue
+                small = self._small(frame)
+                self._checked[cam_id] = self._checked.get(cam_id, 0) + 1
+                ref = self._refs.get(cam_id)
+                if ref is not None and ref.shape == small.shape \
+                        and self._skips.get(cam_id, 0) < self._max_skips \
+                        and self.change_ratio(ref, small) <= self._change_thres:
+                    to_infer[i] = None
+                    skipped.add(i)
+                    self._skips[cam_id] = self._skips.get(cam_id, 0) + 1
+                    self._skipped[cam_id] = self._skipped.get(cam_id, 0) + 1
+                    continue
+                self._refs[cam_id] = small
+                self._skips[cam_id] = 0
+        return to_infer, skipped
+
+    def cached(self, cam_id):
+        """Боксы последнего инференса камеры, предшествующего пропущенному снимку."""
+        with self._lock:
+            return list(self._boxes.get(cam_id, []))
+
+    def update(self, cam_id, boxes) -> None:
+        """Запомнить боксы инференса кадра, который select() сделал эталоном."""
+        with self._lock:
+            self._boxes[cam_id] = boxes
+
+    def reset(self) -> None:
+        """Забыть эталоны и боксы (цикл прервался, и боксы отправленных кадров не получены)."""
+        with self._lock:
+            self._refs.clear()
+            self._boxes.clear()
+            self._skips.clear()
+
+    def stats(self) -> dict:
+        """{cam_id: {'checked': n, 'skipped': m}} — сколько инференсов удалось пропустить."""
+        with self._lock:
+            return {cam_id: {'checked': n, 'skipped': self._skipped.get(cam_id, 0)}
+                    for cam_id, n in self._checked.items()}
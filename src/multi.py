@@ -0,0 +1,135 @@
+# src/multi.py
+import asyncio
+import logging
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from logger import setup_logging, cycle_id
+from async_controller_client import AsyncControllerClient
+from video_capture import VideoCapture
+from detector import Detector
+from inference_server import RemoteDetector
+from analyzer import average_counts
+from decision import DecisionEngine
+from scheduler import AsyncPhaseScheduler
+from pipeline import ShotReader
+from metrics import REGISTRY, start_http_server
+
+CAM_IDS = ('1', '2', '3', '4')
+
+class IntersectionRunner:
+    """
+    Цикл одного перекрёстка внутри общего event loop.
+    Свои контроллер, камеры, маски и DecisionEngine; модель и пул инференса общие для всех.
+    """
+    def __init__(self, name: str, config: Config, detector: Detector, infer_pool: ThreadPoolExecutor):
+        self.name = name
+        self._cfg = config
+        self._detector = detector
+        self._infer_pool = infer_pool
+        self._ctrl = AsyncControllerClient(config)
+        self._vc = VideoCapture(config)
+        self._dec = DecisionEngine(config)
+        self._scheduler = AsyncPhaseScheduler(config, self._ctrl)
+        self._retry_delay = config.get('multi', 'error_retry_sec', default=1.0)
+        self._log = logging.getLogger(f"Intersection[{name}]")
+        self._cycles = 0
+
+    async def detection_cycle(self):
+        """Захват N кадров, подсчёт машин, решение и смена программы."""
+        loop = asyncio.get_running_loop()
+        # у каждой задачи перекрёстка свой контекст, номера циклов не смешиваются
+        self._cycles += 1
+        cycle_id.set(f"{self.name}:{self._cycles}")
+        shots = self._cfg.get('analysis', 'shots_per_phase')
+        counts_12, counts_34 = [], []
+        # как и в DetectionPipeline: следующий снимок — только после новых кадров от живых камер
+        reader = ShotReader(self._cfg, self._vc)
+        for shot in range(shots):
+            if shot:
+                await asyncio.to_thread(reader.wait)
+            frames, rois = await asyncio.to_thread(reader.read, CAM_IDS)
+            # run_in_executor, в отличие от to_thread, не передаёт контекст (номер цикла) в поток пула
+            b1, b2, b3, b4 = await loop.run_in_executor(
+                self._infer_pool, contextvars.copy_context().run, self._detector.predict_batch, frames, rois)
+            if self._cfg.get('analysis', 'count_by_zones', default=False):
+                # только машины в зонах подсчёта камеры
+                b1, b2, b3, b4 = [self._in_zones(cam_id, f, b)
+                                  for cam_id, f, b in zip(CAM_IDS, frames, (b1, b2, b3, b4))]
+            counts_12.append(len(b1) + len(b2))
+            counts_34.append(len(b3) + len(b4))
+
+        avg_12 = average_counts(counts_12)
+        avg_34 = average_counts(counts_34)
+        prog = await self._ctrl.get_current_program()
+        new_prog = self._dec.decide(prog, avg_12, avg_34)
+
+        if new_prog != prog:
+            await self._ctrl.set_program(new_prog)
+            REGISTRY.counter('program_switches_total', {'intersection': self.name},
+                             'Смены программы контроллера').inc()
+
+        self._log.info(f"Cycle complete: prog={prog}, avg12={avg_12:.1f}, avg34={avg_34:.1f}, new={new_prog}")
+
+    def _in_zones(self, cam_id, frame, boxes):
+        index = self._vc.zone_index(cam_id, frame.shape) if frame is not None else None
+        return index.inside(boxes) if index is not None else boxes
+
+    async def run(self):
+        self._log.info("Starting intersection loop")
+        while True:
+            try:
+                await self._scheduler.wait_for_trigger()
+                await self.detection_cycle()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # ошибка одного перекрёстка не должна останавливать остальные
+                self._log.error(f"Cycle failed: {e}")
+                await asyncio.sleep(self._retry_delay)
+
+    async def close(self):
+        await self._ctrl.close()
+        self._vc.release()
+
+
+async def run_all(cfg: Config):
+    log = logging.getLogger()
+    names = list((cfg.get('intersections') or {}).keys())
+    if not names:
+        raise RuntimeError("No intersections configured (section 'intersections').")
+
+    # Одна модель на процесс; OpenCV DNN не потокобезопасен, поэтому по умолчанию один поток инференса
+    if cfg.get('inference_server', 'enabled', default=False):
+        detector = RemoteDetector(cfg)
+    else:
+        detector = Detector(cfg)
+    detector.warmup()
+    workers = cfg.get('multi', 'inference_workers', default=1)
+    infer_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+
+    runners = [IntersectionRunner(name, cfg.derive('intersections', name), detector, infer_pool)
+               for name in names]
+    log.info(f"Starting neyro_det multi-intersection service: {', '.join(names)}")
+    try:
+        await asyncio.gather(*(r.run() for r in runners))
+    finally:
+        for r in runners:
+            await r.close()
+        infer_pool.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='neyro_det: несколько перекрёстков в одном процессе')
+    parser.add_argument('--config', default='config/multi.json')
+    args = parser.parse_args()
+
+    cfg = Config(args.config)
+    setup_logging(cfg)
+    if cfg.get('metrics', 'enabled', default=False):
+        start_http_server(cfg.get('metrics', 'port', default=9108), cfg.get('metrics', 'host', default='0.0.0.0'))
+    try:
+        asyncio.run(run_all(cfg))
+    except KeyboardInterrupt:
+        logging.getLogger().info("Shutting down neyro_det multi-intersection service")
@@ -0,0 +1,244 @@
+# src/optimize_model.py
+"""
+Подготовка оптимизированных вариантов ONNX-модели детектора и проверка их точности.
+
+  python src/optimize_model.py int8       – статическая INT8-квантизация, калибровка по кадрам из samples/
+  python src/optimize_model.py fp16       – конвертация весов в FP16 (вход/выход остаются FP32)
+  python src/optimize_model.py fp32       – только оптимизация графа
+  python src/optimize_model.py validate --precision int8 --clip samples/test_vid.mp4
+
+Каждый вариант сохраняется рядом с исходной моделью (yolov5s.int8.onnx) и дополнительно
+в виде графа, уже оптимизированного onnxruntime (yolov5s.int8.opt.onnx), который Detector
+загружает без повторной оптимизации. Вариант выбирается параметром detector.precision.
+"""
+import os
+import glob
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+from config import Config
+from detector import Detector, model_variant_path
+from zones import ZoneIndex, load_zone_file
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+VIDEO_EXTS = ('.mp4', '.avi', '.mov', '.mkv')
+OPT_LEVELS = {'basic': 'ORT_ENABLE_BASIC', 'extended': 'ORT_ENABLE_EXTENDED', 'all': 'ORT_ENABLE_ALL'}
+
+
+def iter_sample_frames(samples_dir, max_frames, video_step):
+    """Кадры для калибровки: все изображения и каждый video_step-й кадр видео из samples_dir."""
+    count = 0
+    for path in sorted(glob.glob(os.path.join(samples_dir, '*'))):
+        ext = os.path.splitext(path)[1].lower()
+        if ext in IMAGE_EXTS:
+            img = cv2.imread(path)
+            if img is not None:
+                yield img
+                count += 1
+        elif ext in VIDEO_EXTS:
+            cap = cv2.VideoCapture(path)
+            idx = 0
+            while count < max_frames:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if idx % video_step == 0:
+                    yield frame
+                    count += 1
+                idx += 1
+            cap.release()
+        if count >= max_frames:
+            return
+
+
+def make_calibration_reader(model_path, frames, input_size):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class FrameCalibrationReader(CalibrationDataReader):
+        """Отдаёт калибровочные кадры в том же препроцессинге, что и Detector."""
+        def __init__(self):
+            session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+            input_name = session.get_inputs()[0].name
+            self._inputs = iter([
+                {input_name: cv2.dnn.blobFromImage(f, 1/255.0, (input_size, input_size), swapRB=True, crop=False)}
+                for f in frames
+            ])
+
+        def get_next(self):
+            return next(self._inputs, None)
+
+    return FrameCalibrationReader()
+
+
+def quantize_int8(model_path, out_path, frames, input_size):
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+    src = model_path
+    try:
+        # shape inference и свёртка констант заметно улучшают качество квантизации
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        prep_path = model_variant_path(model_path, 'prep')
+        quant_pre_process(model_path, prep_path)
+        src = prep_path
+    except Exception as e:
+        print(f'quant_pre_process skipped: {e}')
+    reader = make_calibration_reader(src, frames, input_size)
+    quantize_static(
+        src, out_path, reader,
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    if src != model_path:
+        os.remove(src)
+
+
+def convert_fp16(model_path, out_path):
+    import onnx
+    from onnxconverter_common import float16
+    model = onnx.load(model_path)
+    model = float16.convert_float_to_float16(model, keep_io_types=True)
+    onnx.save(model, out_path)
+
+
+def optimize_graph(model_path, out_path, level):
+    """Прогнать граф через оптимизатор onnxruntime и сохранить результат на диск."""
+    so = ort.SessionOptions()
+    so.graph_optimization_level = getattr(ort.GraphOptimizationLevel, OPT_LEVELS[level])
+    so.optimized_model_filepath = out_path
+    ort.InferenceSession(model_path, sess_options=so, providers=['CPUExecutionProvider'])
+
+
+def load_zones(paths, shape):
+    """Индексы зон из YAML (формат drow_zones.py) по файлам: {имя файла: ZoneIndex}."""
+    return {os.path.splitext(os.path.basename(p))[0]: ZoneIndex(load_zone_file(p), shape) for p in paths}
+
+
+def zone_counts(boxes, zones):
+    return {f"{base}/{zone_id}": n
+            for base, index in zones.items() for zone_id, n in index.counts(boxes).items()}
+
+
+def validate(cfg, precision, clip, zone_files, step, max_frames):
+    """Сравнить количество машин по зонам у варианта precision и у FP32-модели на видеоклипе."""
+    # обе модели через onnxruntime, чтобы сравнение задержек было честным; кэш детекций выключен,
+    # иначе повторная проверка на том же клипе мерила бы попадания в кэш, а не модели
+    cfg = cfg.override({'cache': {'enabled': False}})
+    ref = Detector(cfg.override({'detector': {'backend': 'onnxruntime', 'precision': 'fp32',
+                                              'use_optimized': False}}))
+    var = Detector(cfg.override({'detector': {'backend': 'onnxruntime', 'precision': precision}}))
+
+    cap = cv2.VideoCapture(clip)
+    zones, stats = None, {}
+    lat_ref, lat_var, n, idx = [], [], 0, 0
+    while n < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        idx += 1
+        if (idx - 1) % step:
+            continue
+        if zones is None:
+            h, w = frame.shape[:2]
+            zones = load_zones(zone_files, frame.shape) if zone_files else \
+                {'frame': ZoneIndex([{'id': 'all', 'group_id': 0,
+                                      'points': [[0, 0], [w, 0], [w, h], [0, h]]}], frame.shape)}
+            stats = {name: {'ref': [], 'var': []} for name in zone_counts([], zones)}
+        t0 = time.perf_counter()
+        boxes_ref = ref.predict(frame)
+        t1 = time.perf_counter()
+        boxes_var = var.predict(frame)
+        t2 = time.perf_counter()
+        lat_ref.append(t1 - t0)
+        lat_var.append(t2 - t1)
+        c_ref, c_var = zone_counts(boxes_ref, zones), zone_counts(boxes_var, zones)
+        for name in stats:
+            stats[name]['ref'].append(c_ref[name])
+            stats[name]['var'].append(c_var[name])
+        n += 1
+    cap.release()
+    if n == 0:
+        raise SystemExit(f'No frames read from {clip}')
+
+    report = {
+        'precision': precision,
+        'model': var.model_path,
+        'reference_model': ref.model_path,
+        'clip': clip,
+        'frames': n,
+        'latency_ms': {
+            'fp32_mean': float(np.mean(lat_ref) * 1000),
+            f'{precision}_mean': float(np.mean(lat_var) * 1000),
+            'speedup': float(np.mean(lat_ref) / np.mean(lat_var)),
+        },
+        'zones': {},
+    }
+    for name, s in stats.items():
+        r, v = np.array(s['ref']), np.array(s['var'])
+        report['zones'][name] = {
+            'fp32_mean_count': float(r.mean()),
+            f'{precision}_mean_count': float(v.mean()),
+            'exact_agreement': float((r == v).mean()),
+            'mean_abs_diff': float(np.abs(r - v).mean()),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Квантизация, оптимизация и валидация модели детектора')
+    parser.add_argument('action', choices=['int8', 'fp16', 'fp32', 'validate'])
+    parser.add_argument('--config', default='config/default.json')
+    parser.add_argument('--samples', default='samples', help='каталог с кадрами/видео для калибровки INT8')
+    parser.add_argument('--calib-frames', type=int, default=200)
+    parser.add_argument('--video-step', type=int, default=15, help='брать каждый N-й кадр видео')
+    parser.add_argument('--opt-level', choices=list(OPT_LEVELS), default='extended',
+                        help='уровень оптимизации графа (all привязывает граф к текущему CPU)')
+    parser.add_argument('--precision', default='int8', help='вариант для validate')
+    parser.add_argument('--clip', default='samples/test_vid.mp4')
+    parser.add_argument('--zones', nargs='*', default=sorted(glob.glob('masks/zone_*.yaml')))
+    parser.add_argument('--max-frames', type=int, default=300)
+    parser.add_argument('--report', default=None, help='куда сохранить JSON-отчёт validate')
+    args = parser.parse_args()
+
+    if ort is None:
+        raise SystemExit('onnxruntime is required')
+    cfg = Config(args.config)
+    model_path = cfg.get('detector', 'model_path')
+    input_size = cfg.get('detector', 'input_size')
+
+    if args.action == 'validate':
+        report = validate(cfg, args.precision, args.clip, args.zones, args.video_step, args.max_frames)
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        print(text)
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return
+
+    out_path = model_variant_path(model_path, args.action)
+    t0 = time.perf_counter()
+    if args.action == 'int8':
+        frames = list(iter_sample_frames(args.samples, args.calib_frames, args.video_step))
+        if not frames:
+            raise SystemExit(f'No calibration frames found in {args.samples}')
+        print(f'Calibrating on {len(frames)} frames from {args.samples}')
+        quantize_int8(model_path, out_path, frames, input_size)
+    elif args.action == 'fp16':
+        convert_fp16(model_path, out_path)
+    if args.action != 'fp32':
+        print(f'Saved {out_path} ({time.perf_counter() - t0:.1f}s)')
+
+    opt_path = model_variant_path(model_path, args.action, optimized=True)
+    optimize_graph(out_path, opt_path, args.opt_level)
+    print(f'Saved optimized graph {opt_path}')
+
+
+if __name__ == '__main__':
+    main()
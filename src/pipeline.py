@@ -0,0 +1,240 @@
+import time
+import queue
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from motion_gate import MotionGate
+
+
+class StageTimings:
+    """
+    Потокобезопасный сборщик времени по стадиям цикла детекции (в секундах).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._totals[stage] = self._totals.get(stage, 0.0) + seconds
+
+    def as_ms(self) -> dict:
+        """Суммарное время каждой стадии в миллисекундах."""
+        with self._lock:
+            return {stage: total * 1000 for stage, total in self._totals.items()}
+
+
+class ShotReader:
+    """
+    Чтение снимков цикла с паузой между ними: следующий снимок читается не раньше min_shot_interval_sec
+    после предыдущего и только когда от каждой камеры, вернувшей кадр в прошлом снимке, пришёл новый кадр,
+    иначе снимки повторяли бы один кадр. Камеры без кадра (недоступные, с устаревшим кадром) не ждём.
+    Ожидание ограничено new_frame_timeout_frames интервалами между кадрами самой медленной из камер,
+    но не дольше new_frame_timeout_sec, чтобы зависшая камера не задерживала снимок.
+    """
+    def __init__(self, config: Config, vc):
+        self._vc = vc
+        self._min_interval = config.get('pipeline', 'min_shot_interval_sec', default=0.0)
+        self._max_timeout = config.get('pipeline', 'new_frame_timeout_sec', default=0.5)
+        self._timeout_frames = config.get('pipeline', 'new_frame_timeout_frames', default=3)
+        self._seqs = None
+        self._last_read = None
+
+    def read(self, cam_ids):
+        """vc.read_many(cam_ids) с запоминанием номеров кадров камер, которые вернули кадр."""
+        self._last_read = time.monotonic()
+        frames, rois = self._vc.read_many(cam_ids)
+        self._seqs = {cam_id: self._vc.frame_seq(cam_id) for cam_id, f in zip(cam_ids, frames) if f is not None}
+        return frames, rois
+
+    def timeout(self) -> float:
+        """Предельное ожидание новых кадров для камер прошлого снимка, с."""
+        intervals = [self._vc.frame_interval(cam_id) for cam_id in self._seqs or ()]
+        intervals = [i for i in intervals if i]
+        if not intervals:
+            return self._max_timeout
+        return min(self._max_timeout, self._timeout_frames * max(intervals))
+
+    def wait(self, stop=None) -> None:
+        """Дождаться момента для следующего снимка; до первого read() возвращается сразу."""
+        if self._seqs is None:
+            return
+        stop = stop or threading.Event()
+        not_before = self._last_read + self._min_interval
+        deadline = not_before + self.timeout()
+        while not stop.is_set():
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            if now >= not_before and all(self._vc.frame_seq(cam_id) > seq for cam_id, seq in self._seqs.items()):
+                return
+            stop.wait(0.005)
+
+
+class DetectionPipeline:
+    """
+    Конвейерный цикл детекции по N снимкам со всех камер:
+      поток-производитель  – захват кадров снимка k+1 и blobFromImages,
+      вызывающий поток     – инференс снимка k,
+      пул потоков          – постпроцессинг/NMS.
+    Очередь между производителем и инференсом ограничена, поэтому кадры не устаревают в ожидании.
+    Пауза между снимками — см. ShotReader.
+    При включённом motion_gate камеры, в зоне которых ничего не изменилось, в батч не попадают —
+    для них берутся боксы последнего инференса.
+    При analysis.count_by_zones остаются только боксы, центр которых лежит в зонах подсчёта камеры,
+    а число машин по зонам и группам зон каждого снимка сохраняется в last_zone_counts
+    ([{cam_id: {'zones': {zone_id: n}, 'groups': {group_id: n}}}]).
+    """
+    def __init__(self, config: Config, vc, detector, cam_ids=('1', '2', '3', '4')):
+        self._vc = vc
+        self._detector = detector
+        self._cam_ids = tuple(cam_ids)
+        self._depth = config.get('pipeline', 'queue_depth', default=1)
+        workers = config.get('pipeline', 'postprocess_workers', default=2)
+        self._config = config
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='postprocess')
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.gate = MotionGate(config) if config.get('motion_gate', 'enabled', default=False) else None
+        self._by_zones = config.get('analysis', 'count_by_zones', default=False)
+        self.last_timings = {}
+        self.last_zone_counts = []
+        # монотонное время получения кадров каждого снимка: [{cam_id: ts}] (None, если кадра не было)
+        self.last_timestamps = []
+        # кадры снимков последнего цикла (для записи трассы); хранятся, только если включено
+        self.keep_frames = False
+        self.last_frames = []
+
+    @property
+    def cam_ids(self):
+        return self._cam_ids
+
+    def run(self, shots: int):
+        """
+        Выполнить цикл из shots снимков.
+        Возвращает список снимков, каждый — список боксов по камерам в порядке cam_ids.
+        Время стадий (wait, capture, gate, preprocess, inference, postprocess, total), мс, — в last_timings.
+        """
+        timings = StageTimings()
+        t_start = time.perf_counter()
+        q = queue.Queue(maxsize=self._depth)
+        stop = threading.Event()
+        # новые потоки и задачи пула стартуют с пустым контекстом: передаём им номер цикла для логов
+        producer = threading.Thread(
+            target=contextvars.copy_context().run, args=(self._produce, shots, q, timings, stop),
+            name='capture-producer', daemon=True
+        )
+        producer.start()
+
+        pending, frames, stamps = [], [], []
+        try:
+            for _ in range(shots):
+                item = q.get()
+                if isinstance(item, Exception):
+                    raise item
+                prepared, gated, zones, shot_frames, shot_stamps = item
+                stamps.append(shot_stamps)
+                if self.keep_frames:
+                    frames.append(shot_frames)
+                t0 = time.perf_counter()
+                preds = self._detector.infer_batch(prepared)
+                timings.add('inference', time.perf_counter() - t0)
+                future = self._pool.submit(contextvars.copy_context().run, self._finish, prepared, preds, timings)
+                pending.append((future, gated, zones))
+            # боксы пропущенных камер и эталоны motion_gate разрешаются строго в порядке снимков
+            results = [self._resolve(future.result(), gated, zones, timings)
+                       for future, gated, zones in pending]
+        except Exception:
+            if self.gate is not None:
+                # эталоны отправленных кадров остались без боксов
+                self.gate.reset()
+            raise
+        finally:
+            # при ошибке инференса производитель не должен навсегда повиснуть на полной очереди
+            stop.set()
+            producer.join()
+        timings.add('total', time.perf_counter() - t_start)
+        self.last_timings = timings.as_ms()
+        self.last_zone_counts = [counts for _, counts in results]
+        self.last_frames = frames
+        self.last_timestamps = stamps
+        return [boxes for boxes, _ in results]
+
+    @staticmethod
+    def _put(q, item, stop) -> bool:
+        """Положить item в очередь; False, если цикл прерван."""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, shots, q, timings, stop):
+        try:
+            reader = ShotReader(self._config, self._vc)
+            for shot in range(shots):
+                if shot:
+                    t0 = time.perf_counter()
+                    reader.wait(stop)
+                    timings.add('wait', time.perf_counter() - t0)
+                if stop.is_set():
+                    return
+                t0 = time.perf_counter()
+                frames, rois = reader.read(self._cam_ids)
+                shot_stamps = {cam_id: self._vc.read_time(cam_id) if f is not None else None
+                               for cam_id, f in zip(self._cam_ids, frames)}
+                t1 = time.perf_counter()
+                shot_frames = frames
+                zones = None
+                if self._by_zones:
+                    zones = [self._vc.zone_index(cam_id, f.shape) if f is not None else None
+                             for cam_id, f in zip(self._cam_ids, frames)]
+                gated = None
+                if self.gate is not None:
+                    frames, skipped = self.gate.select(self._cam_ids, frames)
+                    # индексы пропущенных камер и камер, чьи кадры ушли на инференс
+                    gated = (skipped, {i for i, f in enumerate(frames) if f is not None})
+                    timings.add('gate', time.perf_counter() - t1)
+                t2 = time.perf_counter()
+                prepared = self._detector.prepare_batch(frames, rois)
+                timings.add('capture', t1 - t0)
+                timings.add('preprocess', time.perf_counter() - t2)
+                if not self._put(q, (prepared, gated, zones, shot_frames, shot_stamps), stop):
+                    return
+        except Exception as e:
+            self._log.error(f"Capture stage failed: {e}")
+            self._put(q, e, stop)
+
+    def _finish(self, prepared, preds, timings):
+        t0 = time.perf_counter()
+        boxes = self._detector.finish_batch(prepared, preds)
+        timings.add('postprocess', time.perf_counter() - t0)
+        return boxes
+
+    def _resolve(self, boxes, gated, zones, timings):
+        """Подставить боксы пропущенных motion_gate камер и отфильтровать боксы по зонам подсчёта."""
+        t0 = time.perf_counter()
+        if gated is not None:
+            skipped, sent = gated
+            for i, cam_id in enumerate(self._cam_ids):
+                if i in skipped:
+                    boxes[i] = self.gate.cached(cam_id)
+                elif i in sent:
+                    self.gate.update(cam_id, boxes[i])
+        zone_counts = {}
+        if zones is not None:
+            for i, (cam_id, index) in enumerate(zip(self._cam_ids, zones)):
+                if index is None:
+                    continue
+                labels = index.assign(boxes[i])
+                zone_counts[cam_id] = {'zones': index.counts(boxes[i], labels),
+                                       'groups': index.group_counts(boxes[i], labels)}
+                boxes[i] = index.inside(boxes[i], labels)
+        timings.add('postprocess', time.perf_counter() - t0)
+        return boxes, zone_counts
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
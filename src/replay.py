@@ -0,0 +1,131 @@
+# src/replay.py
+"""
+Повтор записанных циклов (trace.enabled) без камер и контроллера, быстрее реального времени.
+
+  python src/replay.py --trace traces/                       – Detector + DecisionEngine на записанных кадрах
+  python src/replay.py --trace traces/ --recorded-boxes      – только DecisionEngine на записанных боксах
+  python src/replay.py --trace traces/ --config config/new.json --report replay.json
+
+Пороги, модель и параметры DecisionEngine берутся из --config, поэтому их можно сравнивать
+с решениями, которые сервис принял вживую. Подсчёт повторяет режим усреднения по снимкам
+(без трекера); при analysis.count_by_zones учитываются зоны из zone_dir.
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+from config import Config
+from detector import Detector
+from decision import DecisionEngine
+from analyzer import average_counts
+from cycle_trace import TraceReader
+from zones import ZoneIndex, load_zone_file, zone_file_path
+
+
+def to_full_frame(boxes, scale):
+    """Боксы с уменьшенного кадра трассы → координаты полного кадра."""
+    if not scale or scale == 1.0:
+        return boxes
+    return [[v / scale for v in box] for box in boxes]
+
+
+class ZoneFilter:
+    def __init__(self, cfg: Config):
+        self._dir = cfg.get('zone_dir', default=cfg.get('mask_dir'))
+        self._indexes = {}
+
+    def inside(self, cam_id, shape, boxes):
+        key = (cam_id, tuple(shape[:2]))
+        if key not in self._indexes:
+            path = zone_file_path(self._dir, cam_id)
+            self._indexes[key] = ZoneIndex(load_zone_file(path), shape) if os.path.exists(path) else None
+        index = self._indexes[key]
+        return index.inside(boxes) if index is not None else boxes
+
+
+def replay(cfg: Config, trace_dir: str, recorded_boxes: bool = False, limit: int = None) -> dict:
+    reader = TraceReader(trace_dir)
+    entries = reader.index[:limit] if limit else reader.index
+    if not entries:
+        raise SystemExit(f'No recorded cycles in {trace_dir}')
+    det = None
+    if not recorded_boxes:
+        det = Detector(cfg)
+        det.warmup()
+    dec = DecisionEngine(cfg)
+    zones = ZoneFilter(cfg) if cfg.get('analysis', 'count_by_zones', default=False) else None
+
+    cycles, agree, switches_live, switches_replay = [], 0, 0, 0
+    diff_12, diff_34 = [], []
+    t0 = time.perf_counter()
+    try:
+        for entry in entries:
+            if recorded_boxes:
+                shots = reader.boxes(entry)
+            else:
+                shots = []
+                for shot_frames in reader.frames(entry):
+                    shot = det.predict_batch(shot_frames)
+                    shots.append([to_full_frame(b, entry['scales'].get(cam_id))
+                                  for cam_id, b in zip(entry['cams'], shot)])
+            counts_12, counts_34 = [], []
+            for shot in shots:
+                if zones is not None:
+                    shot = [zones.inside(cam_id, entry['shapes'][cam_id], b) if cam_id in entry['shapes'] else b
+                            for cam_id, b in zip(entry['cams'], shot)]
+                b1, b2, b3, b4 = shot
+                counts_12.append(len(b1) + len(b2))
+                counts_34.append(len(b3) + len(b4))
+            avg_12, avg_34 = average_counts(counts_12), average_counts(counts_34)
+            prog = entry['program']
+            new_prog = dec.decide(prog, avg_12, avg_34)
+
+            agree += new_prog == entry['new_program']
+            switches_live += entry['new_program'] != prog
+            switches_replay += new_prog != prog
+            if entry['avg_12'] is not None:
+                diff_12.append(abs(avg_12 - entry['avg_12']))
+                diff_34.append(abs(avg_34 - entry['avg_34']))
+            cycles.append({'cycle': entry['cycle'], 'program': prog, 'live': entry['new_program'],
+                           'replay': new_prog, 'avg_12': avg_12, 'avg_34': avg_34})
+    finally:
+        reader.close()
+    elapsed = time.perf_counter() - t0
+    recorded_span = entries[-1]['ts'] - entries[0]['ts']
+
+    return {
+        'trace': trace_dir,
+        'mode': 'recorded_boxes' if recorded_boxes else 'detector',
+        'model': det.model_path if det is not None else None,
+        'cycles': len(entries),
+        'elapsed_sec': elapsed,
+        'cycles_per_sec': len(entries) / elapsed if elapsed > 0 else 0.0,
+        'speedup_vs_realtime': recorded_span / elapsed if elapsed > 0 else 0.0,
+        'decision_agreement': agree / len(entries),
+        'program_switches': {'live': switches_live, 'replay': switches_replay},
+        'mean_abs_diff': {'avg_12': float(np.mean(diff_12)) if diff_12 else None,
+                          'avg_34': float(np.mean(diff_34)) if diff_34 else None},
+        'per_cycle': cycles,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Повтор записанных циклов детекции')
+    parser.add_argument('--trace', default='traces/')
+    parser.add_argument('--config', default='config/default.json')
+    parser.add_argument('--recorded-boxes', action='store_true', help='не запускать детектор, взять боксы из трассы')
+    parser.add_argument('--limit', type=int, default=None, help='сколько первых циклов повторить')
+    parser.add_argument('--report', default=None, help='куда сохранить JSON-отчёт')
+    args = parser.parse_args()
+
+    report = replay(Config(args.config), args.trace, args.recorded_boxes, args.limit)
+    summary = {k: v for k, v in report.items() if k != 'per_cycle'}
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import time
+import asyncio
+import logging
+from config import Config
+from metrics import LatencyHistogram
+
+class PhaseScheduler:
+    """
+    Планировщик запуска детекции вместо опроса контроллера каждые 200 мс.
+
+    Один запрос phase_status даёт монотонный момент конца фазы; планировщик спит до
+    (конец фазы − traffic_phase_lead_sec − resync_margin_sec), пересинхронизируется с контроллером
+    и досыпает ровно до момента запуска. Фактический запас до конца фазы пишется в гистограмму.
+    """
+    def __init__(self, config: Config, ctrl, phases=(0, 1)):
+        self._ctrl = ctrl
+        self._phases = tuple(phases)
+        self._lead = config.get('controller', 'traffic_phase_lead_sec', default=2)
+        self._margin = config.get('scheduler', 'resync_margin_sec', default=0.5)
+        self._max_sleep = config.get('scheduler', 'max_sleep_sec', default=5.0)
+        self._min_sleep = config.get('scheduler', 'min_sleep_sec', default=0.05)
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._last_trigger = None  # (program, phase, phase_end) последнего запуска
+        self.controller_calls = 0
+        self.lead_hist = LatencyHistogram()
+
+    def _phase_end(self, status, t0: float, t1: float) -> float:
+        """Монотонный момент конца фазы; time_left относим к середине запроса."""
+        self.controller_calls += 1
+        # вызывается при каждой синхронизации: аргументы форматируются, только если DEBUG включён
+        self._log.debug("Prog=%s, phase=%s, time_left=%.1fs, rtt=%.0fms",
+                        status['program'], status['phase'], float(status['time_left']), (t1 - t0) * 1000)
+        return (t0 + t1) / 2 + float(status['time_left'])
+
+    def _sync(self):
+        """Запросить phase_status; вернуть (status, монотонный момент конца фазы)."""
+        t0 = time.monotonic()
+        status = self._ctrl.get_phase_status()
+        return status, self._phase_end(status, t0, time.monotonic())
+
+    def _plan(self, status, phase_end: float):
+        """
+        По очередному phase_status решить, что делать дальше:
+          ('trigger', момент запуска) — досыпаем до него и запускаем детекцию;
+          ('sleep', момент пробуждения) — следующая пересинхронизация с контроллером.
+        """
+        now = time.monotonic()
+        if status['phase'] in self._phases and not self._already_triggered(status, phase_end):
+            trigger_at = phase_end - self._lead
+            if trigger_at - now <= self._margin:
+                return 'trigger', trigger_at
+            wake = trigger_at - self._margin
+        else:
+            # ждём начала следующей фазы
+            wake = phase_end
+        wake = min(wake, now + self._max_sleep)
+        return 'sleep', max(wake, now + self._min_sleep)
+
+    def _fire(self, status, phase_end: float) -> dict:
+        lead = phase_end - time.monotonic()
+        self.lead_hist.observe(max(lead, 0.0))
+        self._last_trigger = (status['program'], status['phase'], phase_end)
+        status['lead'] = lead
+        self._log.info(f"Detection trigger: phase={status['phase']}, lead={lead:.2f}s, "
+                       f"controller calls so far={self.controller_calls}")
+        return status
+
+    @staticmethod
+    def _sleep_until(deadline: float) -> None:
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _already_triggered(self, status, phase_end) -> bool:
+        """Не запускать детекцию повторно в той же фазе."""
+        if self._last_trigger is None:
+            return False
+        program, phase, last_end = self._last_trigger
+        return (status['program'], status['phase']) == (program, phase) and \
+            abs(phase_end - last_end) < self._lead + self._margin
+
+    def wait_for_trigger(self) -> dict:
+        """
+        Блокироваться до момента запуска детекции (за lead секунд до конца фазы из phases).
+        Возвращает последний phase_status, дополненный фактическим запасом 'lead' в секундах.
+        """
+        while True:
+            status, phase_end = self._sync()
+            action, at = self._plan(status, phase_end)
+            self._sleep_until(at)
+            if action == 'trigger':
+                return self._fire(status, phase_end)
+
+    def stats(self) -> dict:
+        """Число запросов к контроллеру и распределение фактического запаса (мс)."""
+        return {'controller_calls': self.controller_calls, 'lead': self.lead_hist.snapshot()}
+
+
+class AsyncPhaseScheduler(PhaseScheduler):
+    """
+    Тот же планировщик для asyncio: ctrl — асинхронный клиент (AsyncControllerClient).
+    """
+    async def wait_for_trigger(self) -> dict:
+        while True:
+            t0 = time.monotonic()
+            status = await self._ctrl.get_phase_status()
+            phase_end = self._phase_end(status, t0, time.monotonic())
+            action, at = self._plan(status, phase_end)
+            await asyncio.sleep(max(at - time.monotonic(), 0))
+            if action == 'trigger':
+                return self._fire(status, phase_end)
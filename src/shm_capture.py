@@ -0,0 +1,162 @@
+import sys
+import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from logger import child_log_queue, setup_child_logging
+from video_capture import decode_loop
+
+
+class ShmFrameRing:
+    """
+    Кольцевой буфер кадров в multiprocessing.shared_memory.
+
+    Раскладка сегмента:
+      header int64[2]         – номер последнего записанного кадра, число отброшенных (слишком больших) кадров
+      meta   int64[slots, 4]  – seq, h, w, c каждого слота (seq = -1, пока слот перезаписывается)
+      ts     float64[slots]   – монотонное время получения кадра
+      data   uint8[slots, max_h*max_w*max_c]
+
+    Писатель один (процесс декодирования), читатели получают NumPy-view без копирования.
+    """
+    def __init__(self, slots: int, max_shape, name: str = None, create: bool = False, track: bool = True):
+        self.slots = slots
+        self.max_shape = tuple(max_shape)
+        self._slot_size = int(np.prod(self.max_shape))
+        header_bytes = 2 * 8
+        meta_bytes = slots * 4 * 8
+        ts_bytes = slots * 8
+        size = header_bytes + meta_bytes + ts_bytes + slots * self._slot_size
+        # track=False (Python 3.13+) не регистрирует подключение в resource_tracker
+        options = {'track': False} if not track and sys.version_info >= (3, 13) else {}
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0, **options)
+        buf = self.shm.buf
+        offset = 0
+        self._header = np.ndarray((2,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += header_bytes
+        self._meta = np.ndarray((slots, 4), dtype=np.int64, buffer=buf, offset=offset)
+        offset += meta_bytes
+        self._ts = np.ndarray((slots,), dtype=np.float64, buffer=buf, offset=offset)
+        offset += ts_bytes
+        self._data = np.ndarray((slots, self._slot_size), dtype=np.uint8, buffer=buf, offset=offset)
+        if create:
+            self._header[:] = 0
+            self._meta[:] = 0
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, frame, ts: float) -> bool:
+        """Записать кадр в следующий слот; False, если кадр больше max_shape и отброшен."""
+        if frame.ndim != 3 or any(d > m for d, m in zip(frame.shape, self.max_shape)):
+            self._header[1] += 1
+            return False
+        seq = int(self._header[0]) + 1
+        k = seq % self.slots
+        self._meta[k, 0] = -1
+        self._data[k, :frame.size].reshape(frame.shape)[...] = frame
+        self._meta[k, 1:4] = frame.shape
+        self._ts[k] = ts
+        self._meta[k, 0] = seq
+        self._header[0] = seq
+        return True
+
+    def latest(self):
+        """(view, timestamp, seq) последнего кадра; view=None, если кадров ещё не было."""
+        seq = int(self._header[0])
+        while seq > 0:
+            k = seq % self.slots
+            if self._meta[k, 0] == seq:
+                h, w, c = (int(v) for v in self._meta[k, 1:4])
+                view = self._data[k, :h * w * c].reshape(h, w, c)
+                return view, float(self._ts[k]), seq
+            # слот как раз перезаписывается — берём свежий номер
+            seq = int(self._header[0])
+        return None, 0.0, 0
+
+    def is_current(self, seq: int) -> bool:
+        """Слот кадра seq ещё не перезаписан писателем."""
+        return seq > 0 and self._meta[seq % self.slots, 0] == seq
+
+    @property
+    def written(self) -> int:
+        return int(self._header[0])
+
+    @property
+    def oversized(self) -> int:
+        return int(self._header[1])
+
+    def close(self) -> None:
+        # view на буфер должны быть освобождены до закрытия сегмента
+        self._header = self._meta = self._ts = self._data = None
+        self.shm.close()
+
+
+def _decode_worker(cam_id, uri, shm_name, slots, max_shape, stop_event, reconnect_delay, open_timeout,
+                   log_queue, log_level):
+    """Точка входа процесса декодирования: пишет кадры камеры в кольцевой буфер."""
+    # записи уходят в основной процесс и пишутся его обработчиками
+    setup_child_logging(log_queue, log_level)
+    log = logging.getLogger(f"ProcessCameraReader[{cam_id}]")
+    # сегментом владеет родительский процесс: он удаляет его в join(). resource_tracker у дочерних
+    # процессов multiprocessing общий с родителем, поэтому снимать регистрацию здесь нельзя —
+    # пропала бы и регистрация родителя (KeyError в трекере при unlink, утечка сегмента при SIGKILL)
+    ring = ShmFrameRing(slots, max_shape, name=shm_name, track=False)
+
+    warned = False
+
+    def on_frame(frame, ts):
+        nonlocal warned
+        if not ring.write(frame, ts) and not warned:
+            # дальше такие кадры видны только в счётчике oversized (capture_stats)
+            log.error(f"Frame {frame.shape} exceeds shm_max_frame_shape {max_shape}, "
+                      f"frames from this camera are dropped", extra={'camera': cam_id})
+            warned = True
+
+    try:
+        decode_loop(cam_id, uri, stop_event, on_frame, reconnect_delay, log, open_timeout)
+    finally:
+        ring.close()
+
+
+class ProcessCameraReader:
+    """
+    Камера, декодируемая в отдельном процессе (в обход GIL основного процесса).
+    Кадры публикуются в ShmFrameRing, latest() отдаёт NumPy-view на слот без копирования.
+    Интерфейс совпадает с CameraReader.
+    """
+    def __init__(self, cam_id: str, uri: str, reconnect_delay: float = 2.0,
+                 slots: int = 4, max_shape=(1080, 1920, 3), open_timeout: float = None):
+        self.cam_id = cam_id
+        self._ring = ShmFrameRing(slots, max_shape, create=True)
+        self._stop_event = mp.Event()
+        self._proc = mp.Process(
+            target=_decode_worker,
+            args=(cam_id, uri, self._ring.name, slots, tuple(max_shape), self._stop_event,
+                  reconnect_delay, open_timeout, child_log_queue(), logging.getLogger().level),
+            name=f"cam{cam_id}-decoder",
+            daemon=True,
+        )
+
+    def start(self):
+        self._proc.start()
+
+    def latest(self):
+        return self._ring.latest()
+
+    def is_current(self, seq: int) -> bool:
+        return self._ring.is_current(seq)
+
+    def stats(self) -> dict:
+        return {'decoded': self._ring.written, 'oversized': self._ring.oversized}
+
+    def stop(self):
+        self._stop_event.set()
+
+    def join(self, timeout=None):
+        self._proc.join(timeout)
+        if self._proc.is_alive():
+            self._proc.terminate()
+        self._ring.close()
+        self._ring.shm.unlink()
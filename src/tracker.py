@@ -0,0 +1,151 @@
+import time
+import itertools
+import numpy as np
+from config import Config
+
+
+def iou_matrix(a, b):
+    """IoU каждой пары боксов [x, y, w, h] из a (M×4) и b (N×4)."""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+    iw = np.clip(np.minimum(ax2[:, None], bx2[None]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    ih = np.clip(np.minimum(ay2[:, None], by2[None]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = iw * ih
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0.0)
+
+
+class KalmanBoxTrack:
+    """
+    Трек одной машины: фильтр Калмана с постоянной скоростью,
+    состояние [cx, cy, w, h, vx, vy, vw, vh].
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, box, ts: float):
+        x, y, w, h = box
+        self.id = next(self._ids)
+        self.x = np.array([x + w / 2, y + h / 2, w, h, 0, 0, 0, 0], dtype=np.float64)
+        self.P = np.diag([10, 10, 10, 10, 1e3, 1e3, 1e3, 1e3]).astype(np.float64)
+        self.ts = ts
+        self.hits = 1
+        self.misses = 0
+        self.confirmed = False
+
+    def predict(self, ts: float):
+        dt = max(ts - self.ts, 0.0)
+        self.ts = ts
+        F = np.eye(8)
+        F[:4, 4:] = np.eye(4) * dt
+        # шум процесса растёт с интервалом: между циклами проходят десятки секунд
+        scale = max(self.x[2], self.x[3], 1.0)
+        Q = np.diag([1, 1, 1, 1, 0.1, 0.1, 0.1, 0.1]) * (scale * 0.05) ** 2 * max(dt, 1e-3)
+        self.x = F @ self.x
+        self.x[2:4] = np.maximum(self.x[2:4], 1.0)
+        self.P = F @ self.P @ F.T + Q
+        return self.box
+
+    def update(self, box):
+        x, y, w, h = box
+        z = np.array([x + w / 2, y + h / 2, w, h], dtype=np.float64)
+        H = np.eye(4, 8)
+        R = np.eye(4) * (max(w, h, 1.0) * 0.1) ** 2
+        S = H @ self.P @ H.T + R
+        K = self.P @ H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ (z - H @ self.x)
+        self.P = (np.eye(8) - K @ H) @ self.P
+        self.hits += 1
+        self.misses = 0
+
+    @property
+    def box(self):
+        cx, cy, w, h = self.x[:4]
+        return [cx - w / 2, cy - h / 2, w, h]
+
+
+class SortTracker:
+    """
+    SORT‑подобный трекер: предсказание Калманом, жадное сопоставление по IoU.
+    Трек подтверждается после min_hits совпадений и удаляется после max_misses обновлений без совпадения.
+    """
+    def __init__(self, iou_threshold: float = 0.3, max_misses: int = 3, min_hits: int = 2):
+        self._iou_thres = iou_threshold
+        self._max_misses = max_misses
+        self._min_hits = min_hits
+        self.tracks = []
+        self.arrivals = 0
+        self.departures = 0
+
+    def update(self, boxes, ts: float = None):
+        """Обновить треки боксами очередного кадра; возвращает [(track_id, box)] подтверждённых треков."""
+        ts = time.monotonic() if ts is None else ts
+        predicted = [t.predict(ts) for t in self.tracks]
+        matched_t, matched_d = set(), set()
+        if predicted and len(boxes):
+            iou = iou_matrix(predicted, boxes)
+            # жадно: пары в порядке убывания IoU
+            for ti, di in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+                if iou[ti, di] < self._iou_thres:
+                    break
+                if ti in matched_t or di in matched_d:
+                    continue
+                self.tracks[ti].update(boxes[di])
+                matched_t.add(ti)
+                matched_d.add(di)
+
+        alive = []
+        for i, t in enumerate(self.tracks):
+            if i not in matched_t:
+                t.misses += 1
+            if t.misses > self._max_misses:
+                if t.confirmed:
+                    self.departures += 1
+                continue
+            alive.append(t)
+        for di, box in enumerate(boxes):
+            if di not in matched_d:
+                alive.append(KalmanBoxTrack(box, ts))
+        for t in alive:
+            if not t.confirmed and t.hits >= self._min_hits:
+                t.confirmed = True
+                self.arrivals += 1
+        self.tracks = alive
+        return [(t.id, t.box) for t in self.tracks if t.confirmed and t.misses == 0]
+
+    @property
+    def queue_length(self) -> int:
+        """
+        Число подтверждённых треков, найденных на последнем кадре. Пропавшие треки живут ещё
+        max_misses обновлений, чтобы машину можно было снова сопоставить, но в очередь не входят:
+        иначе уехавшие между циклами машины считались бы в следующем цикле.
+        """
+        return sum(1 for t in self.tracks if t.confirmed and t.misses == 0)
+
+
+class ZoneTracker:
+    """
+    Трекеры по зонам (камерам) с сохранением треков между циклами детекции.
+    report() возвращает длину очереди, число прибывших и уехавших машин с прошлого отчёта.
+    """
+    def __init__(self, config: Config):
+        self._params = dict(
+            iou_threshold=config.get('tracker', 'iou_threshold', default=0.3),
+            max_misses=config.get('tracker', 'max_misses', default=3),
+            min_hits=config.get('tracker', 'min_hits', default=2),
+        )
+        self._trackers = {}
+
+    def update(self, zone_id, boxes, ts: float = None):
+        if zone_id not in self._trackers:
+            self._trackers[zone_id] = SortTracker(**self._params)
+        return self._trackers[zone_id].update(boxes, ts)
+
+    def report(self) -> dict:
+        """{zone_id: {'queue': n, 'arrivals': a, 'departures': d}}; счётчики событий обнуляются."""
+        result = {}
+        for zone_id, tr in self._trackers.items():
+            result[zone_id] = {'queue': tr.queue_length, 'arrivals': tr.arrivals, 'departures': tr.departures}
+            tr.arrivals = tr.departures = 0
+        return result
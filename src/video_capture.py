@@ -1,64 +1,431 @@
 import cv2
 import json
 import os
+import time
 import logging
+import threading
 import numpy as np
 from config import Config
+from metrics import REGISTRY
+from zones import ZoneIndex, load_zone_file, zone_file_path
+
+STREAM_SCHEMES = ('rtsp://', 'rtmp://', 'http://', 'https://')
+
+
+def open_source(uri, open_timeout=None):
+    """
+    Открыть источник видео; вернуть (cap, пауза между кадрами в секундах).
+    open_timeout ограничивает открытие и чтение потока (FFmpeg), чтобы недоступная камера
+    не висела десятки секунд. Файлы читаем в темпе их FPS, живые потоки — так быстро, как приходят кадры.
+    """
+    params = []
+    if open_timeout and hasattr(cv2, 'CAP_PROP_OPEN_TIMEOUT_MSEC'):
+        ms = int(open_timeout * 1000)
+        params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, ms, cv2.CAP_PROP_READ_TIMEOUT_MSEC, ms]
+    cap = cv2.VideoCapture(uri, cv2.CAP_ANY, params) if params else cv2.VideoCapture(uri)
+    frame_interval = 0.0
+    if cap.isOpened() and not str(uri).startswith(STREAM_SCHEMES):
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if fps and fps > 0:
+            frame_interval = 1.0 / fps
+    return cap, frame_interval
+
+
+def decode_loop(cam_id, uri, stop_event, on_frame, reconnect_delay, log, open_timeout=None):
+    """
+    Непрерывно декодировать источник до stop_event, передавая каждый кадр в on_frame(frame, ts).
+    При ошибке чтения источник переоткрывается через reconnect_delay секунд.
+    Используется и потоками CameraReader, и процессами декодирования (shm_capture).
+    """
+    cap, frame_interval = open_source(uri, open_timeout)
+    if not cap.isOpened():
+        log.error(f"Cannot open camera {cam_id} ({uri})", extra={'camera': cam_id})
+    failed = False
+    while not stop_event.is_set():
+        ret, frame = cap.read()
+        if not ret:
+            if not failed:
+                log.error(f"Failed to read from camera {cam_id}, reconnecting", extra={'camera': cam_id})
+                failed = True
+            cap.release()
+            if stop_event.wait(reconnect_delay):
+                break
+            cap, frame_interval = open_source(uri, open_timeout)
+            continue
+        if failed:
+            log.info(f"Camera {cam_id} is back online", extra={'camera': cam_id})
+            failed = False
+        on_frame(frame, time.monotonic())
+        if frame_interval:
+            stop_event.wait(frame_interval)
+    cap.release()
+
+
+class CameraReader(threading.Thread):
+    """
+    Фоновый поток одной камеры: непрерывно вычитывает поток и хранит
+    только последний декодированный кадр (с временем получения и номером).
+    Так буфер OpenCV/FFmpeg не накапливает старые кадры между циклами детекции.
+    """
+    def __init__(self, cam_id: str, uri: str, reconnect_delay: float = 2.0, open_timeout: float = None):
+        super().__init__(name=f"cam{cam_id}-reader", daemon=True)
+        self.cam_id = cam_id
+        self._uri = uri
+        self._reconnect_delay = reconnect_delay
+        self._open_timeout = open_timeout
+        self._log = logging.getLogger(f"{self.__class__.__name__}[{cam_id}]")
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._frame = None
+        self._timestamp = 0.0
+        self._seq = 0
+
+    def run(self):
+        decode_loop(self.cam_id, self._uri, self._stop_event, self._publish,
+                    self._reconnect_delay, self._log, self._open_timeout)
+
+    def _publish(self, frame, ts):
+        with self._lock:
+            self._frame = frame
+            self._timestamp = ts
+            self._seq += 1
+
+    def latest(self):
+        """Вернуть (frame, timestamp, seq) последнего кадра; frame=None, если кадров ещё не было."""
+        with self._lock:
+            return self._frame, self._timestamp, self._seq
+
+    def is_current(self, seq: int) -> bool:
+        """Кадр seq по-прежнему доступен без изменений (в потоковом режиме кадры не перезаписываются)."""
+        return True
+
+    def stats(self) -> dict:
+        return {'decoded': self._seq}
+
+    def stop(self):
+        self._stop_event.set()
+
 
 class VideoCapture:
     """
     Захват и маскирование кадров из RTSP-потоков или файлов.
+    Каждая камера читается отдельным потоком CameraReader (или процессом ProcessCameraReader
+    в режиме capture.mode = "process"), read() сразу отдаёт самый свежий кадр.
     Маски хранятся в директории mask_dir в формате JSON с ключом "polygons": [ [x,y], ... ].
+    Зоны подсчёта (полосы) — в zone_dir в файлах zone_{cam_id}.yaml формата drow_zones.py.
     """
     def __init__(self, config: Config):
         self._cams = config.get('cameras') or {}
         self._mask_dir = config.get('mask_dir')
-        self._caps = {}
+        self._zone_dir = config.get('zone_dir', default=self._mask_dir)
+        # запас вокруг зон подсчёта при crop_to_zone, чтобы не резать машины на границе зоны
+        self._crop_margin = config.get('detector', 'crop_margin', default=32)
+        self._max_age = config.get('capture', 'max_frame_age_sec', default=1.0)
+        self._reconnect_delay = config.get('capture', 'reconnect_delay_sec', default=2.0)
+        self._open_timeout = config.get('capture', 'open_timeout_sec', default=10.0)
+        # thread – декодирование в потоках этого процесса, process – в отдельных процессах через shared memory
+        self._mode = config.get('capture', 'mode', default='thread')
+        self._shm_slots = config.get('capture', 'shm_slots', default=4)
+        self._shm_max_shape = config.get('capture', 'shm_max_frame_shape', default=[1080, 1920, 3])
+        self._readers = {}
+        self._last_seq = {}
+        self._last_ts = {}
+        self._intervals = {}
+        self._dropped = {}
+        self._overwritten = {}
         self._masks = {}
+        self._mask_mtimes = {}
+        self._mask_cache = {}
+        self._zone_cache = {}
+        # при hot_reload файлы масок и зон перечитывает reload_masks() между циклами,
+        # иначе их mtime проверяется при каждом чтении кадра
+        self._check_mtime = not config.get('hot_reload', 'enabled', default=False)
         self._log = logging.getLogger(self.__class__.__name__)
         self._init_cameras()
         self._load_masks()
 
     def _init_cameras(self):
+        # Камеры открываются параллельно: каждая в своём потоке/процессе чтения
+        self._started_at = time.monotonic()
         for cam_id, uri in self._cams.items():
-            cap = cv2.VideoCapture(uri)
-            if not cap.isOpened():
-                self._log.error(f"Cannot open camera {cam_id} ({uri})")
-            self._caps[cam_id] = cap
-            self._log.debug(f"Initialized VideoCapture for camera {cam_id}")
+            if self._mode == 'process':
+                from shm_capture import ProcessCameraReader
+                reader = ProcessCameraReader(cam_id, uri, self._reconnect_delay,
+                                             self._shm_slots, self._shm_max_shape, self._open_timeout)
+            else:
+                reader = CameraReader(cam_id, uri, self._reconnect_delay, self._open_timeout)
+            reader.start()
+            self._readers[cam_id] = reader
+            self._log.debug(f"Initialized VideoCapture for camera {cam_id} ({self._mode} mode)")
+
+    def wait_ready(self, timeout: float = None) -> dict:
+        """
+        Дождаться первого кадра от каждой камеры, но не дольше timeout секунд
+        (по умолчанию capture.open_timeout_sec) от начала открытия.
+        Возвращает {cam_id: секунды до первого кадра или None, если камера не успела}.
+        """
+        timeout = self._open_timeout if timeout is None else timeout
+        deadline = self._started_at + (timeout or 0)
+        ready = {}
+        pending = set(self._readers)
+        while pending:
+            for cam_id in list(pending):
+                if self._readers[cam_id].latest()[0] is not None:
+                    ready[cam_id] = time.monotonic() - self._started_at
+                    pending.discard(cam_id)
+            if not pending or time.monotonic() >= deadline:
+                break
+            time.sleep(0.02)
+        for cam_id in pending:
+            ready[cam_id] = None
+            self._log.error(f"Camera {cam_id} is not ready after {timeout}s, continuing without it", extra={'camera': cam_id})
+        return ready
 
     def _load_masks(self):
         for cam_id in self._cams:
-            path = os.path.join(self._mask_dir, f"cam{cam_id}_mask.json")
-            if os.path.isfile(path):
+            self._load_mask(cam_id)
+
+    def _mask_path(self, cam_id: str) -> str:
+        return os.path.join(self._mask_dir, f"cam{cam_id}_mask.json")
+
+    @staticmethod
+    def _mtime(path: str):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _load_mask(self, cam_id: str) -> None:
+        """Прочитать полигоны маски камеры и запомнить mtime файла."""
+        path = self._mask_path(cam_id)
+        mtime = self._mtime(path)
+        if mtime is not None:
+            try:
                 with open(path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self._masks[cam_id] = data.get('polygons', [])
-                    self._log.debug(f"Loaded mask for cam {cam_id}")
-            else:
-                self._masks[cam_id] = []
-                self._log.warning(f"Mask file not found for cam {cam_id}, no masking applied.")
+                    polygons = json.load(f).get('polygons', [])
+                if not isinstance(polygons, list):
+                    raise ValueError("'polygons' must be a list")
+            except (OSError, ValueError, AttributeError) as e:
+                # недописанный или испорченный файл: остаётся прежняя маска
+                self._log.error(f"Invalid mask file {path}: {e}, keeping previous mask", extra={'camera': cam_id})
+                self._mask_mtimes[cam_id] = mtime
+                return
+            self._masks[cam_id] = polygons
+            self._log.debug(f"Loaded mask for cam {cam_id}")
+        else:
+            self._masks[cam_id] = []
+            self._log.warning(f"Mask file not found for cam {cam_id}, no masking applied.", extra={'camera': cam_id})
+        self._mask_mtimes[cam_id] = mtime
+        # полигоны поменялись — растровую маску нужно пересобрать
+        self._mask_cache.pop(cam_id, None)
+
+    def _get_mask(self, cam_id: str, shape):
+        """
+        Растровая маска камеры для кадра формы shape (h, w, c) или None, если маскировать нечего.
+        Строится один раз и пересобирается только при смене mtime файла маски или разрешения потока.
+        """
+        if self._check_mtime and self._mtime(self._mask_path(cam_id)) != self._mask_mtimes.get(cam_id):
+            self._load_mask(cam_id)
+        cached = self._mask_cache.get(cam_id)
+        if cached is not None and cached[0] == shape:
+            return cached[1]
+        polygons = self._masks.get(cam_id, [])
+        mask = self._create_mask(shape, polygons) if polygons else None
+        rect = self._mask_rect(mask)
+        self._mask_cache[cam_id] = (shape, mask, rect)
+        self._log.debug(f"Built mask for cam {cam_id}, shape={shape}, zone rect={rect}")
+        return mask
+
+    def zone_rect(self, cam_id: str, shape):
+        """
+        Прямоугольник (x, y, w, h) кадра формы shape, по которому идёт инференс при crop_to_zone:
+        объединение зон подсчёта камеры с запасом detector.crop_margin, а без файла зон —
+        незамаскированная область. None, если анализируется весь кадр.
+        """
+        index = self.zone_index(cam_id, shape)
+        if index is not None and index.polygons:
+            return index.bounding_rect(self._crop_margin)
+        self._get_mask(cam_id, shape)
+        return self._mask_cache[cam_id][2]
+
+    def zone_index(self, cam_id: str, shape):
+        """
+        ZoneIndex зон подсчёта камеры для кадра формы shape или None, если файла зон нет.
+        Пересобирается при смене mtime файла или разрешения потока.
+        """
+        cached = self._zone_cache.get(cam_id)
+        if cached is not None and cached[0] == shape[:2]:
+            if not self._check_mtime or cached[1] == self._mtime(zone_file_path(self._zone_dir, cam_id)):
+                return cached[2]
+        return self._build_zone_index(cam_id, shape)
 
-    def read(self, cam_id: str):
+    def _build_zone_index(self, cam_id: str, shape):
+        path = zone_file_path(self._zone_dir, cam_id)
+        mtime = self._mtime(path)
+        cached = self._zone_cache.get(cam_id)
+        index = None
+        if mtime is not None:
+            try:
+                index = ZoneIndex(load_zone_file(path), shape)
+                self._log.debug(f"Built zone index for cam {cam_id}: zones={index.ids}, shape={shape}")
+            except Exception as e:
+                self._log.error(f"Failed to load zones for cam {cam_id} from {path}: {e}", extra={'camera': cam_id})
+                if cached is not None and cached[0] == shape[:2]:
+                    # испорченный файл зон: остаются прежние зоны
+                    index = cached[2]
+        self._zone_cache[cam_id] = (shape[:2], mtime, index)
+        return index
+
+    def reload_masks(self, paths=None) -> None:
         """
-        Вернуть следующий маскированный кадр для указанной камеры.
+        Перечитать маски и зоны камер (все или только те, чьи файлы есть в paths) и сразу
+        пересобрать растровые маски и индексы зон под текущее разрешение потоков.
         """
-        cap = self._caps.get(cam_id)
-        if not cap:
-            self._log.error(f"Camera {cam_id} not initialized")
+        paths = {os.path.abspath(p) for p in paths} if paths is not None else None
+        for cam_id in self._cams:
+            if paths is None or os.path.abspath(self._mask_path(cam_id)) in paths:
+                shape = self._mask_cache.get(cam_id, (None,))[0]
+                self._load_mask(cam_id)
+                if shape is not None:
+                    self._get_mask(cam_id, shape)
+                self._log.info(f"Mask reloaded for cam {cam_id}", extra={'camera': cam_id})
+            zone_path = zone_file_path(self._zone_dir, cam_id)
+            if paths is None or os.path.abspath(zone_path) in paths:
+                cached = self._zone_cache.get(cam_id)
+                if cached is not None:
+                    self._build_zone_index(cam_id, cached[0])
+                self._log.info(f"Zones reloaded for cam {cam_id}", extra={'camera': cam_id})
+
+    @staticmethod
+    def _mask_rect(mask):
+        if mask is None:
             return None
-        ret, frame = cap.read()
-        if not ret:
-            self._log.error(f"Failed to read from camera {cam_id}")
+        plane = mask[..., 0] if mask.ndim == 3 else mask
+        x, y, w, h = cv2.boundingRect(plane)
+        return (x, y, w, h) if w > 0 and h > 0 else None
+
+    def read(self, cam_id: str, max_age: float = None):
+        """
+        Вернуть самый свежий маскированный кадр для указанной камеры.
+        Кадр старше max_age секунд (по умолчанию capture.max_frame_age_sec) считается устаревшим,
+        и тогда возвращается None.
+        """
+        labels = {'camera': cam_id}
+        t0 = time.perf_counter()
+        for _ in range(2):
+            frame, seq = self.read_view(cam_id, max_age)
+            if frame is None:
+                break
+            # результат всегда новый массив: слот остаётся нетронутым для следующих чтений
+            mask = self._get_mask(cam_id, frame.shape)
+            result = frame.copy() if mask is None else cv2.bitwise_and(frame, mask)
+            if self.is_current(cam_id, seq):
+                REGISTRY.histogram('capture_read_seconds', labels,
+                                   'Время чтения и маскирования кадра').observe(time.perf_counter() - t0)
+                return result
+            # в режиме process слот перезаписали во время чтения — берём следующий кадр
+            self._overwritten[cam_id] = self._overwritten.get(cam_id, 0) + 1
+        else:
+            self._log.warning(f"Camera {cam_id}: frame overwritten while reading, skipped", extra={'camera': cam_id})
+        REGISTRY.counter('capture_failed_reads_total', labels, 'Чтения без пригодного кадра').inc()
+        return None
+
+    def read_view(self, cam_id: str, max_age: float = None):
+        """
+        Самый свежий кадр камеры без маски и без копирования: (view, seq) или (None, 0).
+        В режиме process view указывает прямо в кольцевой буфер shared memory и остаётся
+        корректным, пока is_current(cam_id, seq) возвращает True.
+        """
+        reader = self._readers.get(cam_id)
+        if not reader:
+            self._log.error(f"Camera {cam_id} not initialized", extra={'camera': cam_id})
+            return None, 0
+        frame, ts, seq = reader.latest()
+        if frame is None or frame.size == 0:
+            REGISTRY.counter('capture_empty_frames_total', {'camera': cam_id}, 'Нет кадра от камеры').inc()
+            self._log.error(f"No frames from camera {cam_id} yet", extra={'camera': cam_id})
+            return None, 0
+        age = time.monotonic() - ts
+        max_age = self._max_age if max_age is None else max_age
+        if max_age is not None and age > max_age:
+            REGISTRY.counter('capture_stale_frames_total', {'camera': cam_id}, 'Устаревшие кадры').inc()
+            self._log.warning(f"Stale frame from camera {cam_id}: age={age:.2f}s, skipped", extra={'camera': cam_id})
+            return None, 0
+        last = self._last_seq.get(cam_id)
+        if last is not None and seq > last + 1:
+            # кадры, которые декодировались, но так и не были прочитаны
+            self._dropped[cam_id] = self._dropped.get(cam_id, 0) + seq - last - 1
+        if last is not None and seq > last:
+            # сглаженный интервал между кадрами камеры по двум соседним чтениям
+            interval = (ts - self._last_ts[cam_id]) / (seq - last)
+            prev = self._intervals.get(cam_id)
+            self._intervals[cam_id] = interval if prev is None else prev + 0.2 * (interval - prev)
+        self._last_seq[cam_id] = seq
+        self._last_ts[cam_id] = ts
+        return frame, seq
+
+    def is_current(self, cam_id: str, seq: int) -> bool:
+        """Кадр seq камеры ещё не перезаписан (всегда True в режиме thread)."""
+        reader = self._readers.get(cam_id)
+        return bool(reader) and reader.is_current(seq)
+
+    def capture_stats(self) -> dict:
+        """
+        Счётчики по камерам: decoded – декодировано кадров, dropped – не дошли до чтения,
+        overwritten – перезаписаны во время чтения (режим process), oversized – не влезли в слот.
+        """
+        stats = {}
+        for cam_id, reader in self._readers.items():
+            cam = dict(reader.stats())
+            cam['dropped'] = self._dropped.get(cam_id, 0)
+            cam['overwritten'] = self._overwritten.get(cam_id, 0)
+            stats[cam_id] = cam
+        return stats
+
+    def read_many(self, cam_ids):
+        """
+        Прочитать свежие кадры нескольких камер.
+        Возвращает (frames, rois): кадры (None для недоступных) и прямоугольники их зон.
+        """
+        frames = [self.read(cam_id) for cam_id in cam_ids]
+        rois = [self.zone_rect(cam_id, f.shape) if f is not None else None
+                for cam_id, f in zip(cam_ids, frames)]
+        return frames, rois
+
+    def read_time(self, cam_id: str):
+        """Монотонное время получения кадра, последним отданного read()/read_view(), или None."""
+        return self._last_ts.get(cam_id)
+
+    def frame_interval(self, cam_id: str):
+        """Средний интервал между кадрами камеры в секундах (по прочитанным кадрам) или None, пока неизвестен."""
+        return self._intervals.get(cam_id)
+
+    def frame_age(self, cam_id: str):
+        """Возраст последнего кадра камеры в секундах или None, если кадров нет."""
+        reader = self._readers.get(cam_id)
+        if not reader:
+            return None
+        frame, ts, _ = reader.latest()
+        if frame is None:
             return None
-        mask = self._create_mask(frame.shape[:2], self._masks.get(cam_id, []))
-        frame[mask == 0] = 0
-        return frame
+        return time.monotonic() - ts
+
+    def frame_seq(self, cam_id: str) -> int:
+        """Порядковый номер последнего кадра камеры (0 — кадров ещё не было)."""
+        reader = self._readers.get(cam_id)
+        return reader.latest()[2] if reader else 0
+
+    def release(self):
+        """Остановить потоки/процессы чтения и освободить камеры."""
+        for reader in self._readers.values():
+            reader.stop()
+        for reader in self._readers.values():
+            reader.join(timeout=self._reconnect_delay + 1)
 
     def _create_mask(self, shape, polygons):
-        h, w = shape
-        mask = 255 * np.ones((h, w), dtype='uint8')
+        """Маска той же формы, что и кадр: 0 внутри полигонов, 255 снаружи."""
+        mask = np.full(shape, 255, dtype='uint8')
         for poly in polygons:
             pts = np.array(poly, dtype='int32')
-            cv2.fillPoly(mask, [pts], 0)
-        return mask
\ No newline at end of file
+            cv2.fillPoly(mask, [pts], (0,) * mask.shape[2] if mask.ndim == 3 else 0)
+        return mask
@@ -0,0 +1,113 @@
+import os
+import cv2
+import yaml
+import numpy as np
+
+
+def load_zone_file(path: str):
+    """
+    Зоны из YAML в формате drow_zones.py: zones: [{id, group_id, points: [[x, y], ...]}].
+    Файл старого формата с единственным ключом points считается одной зоной с id=1.
+    Необязательный ключ relative (у зоны или у всего файла) явно задаёт, относительные ли координаты.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f) or {}
+    entries = data.get('zones') or [{'id': 1, 'points': data.get('points')}]
+    return [
+        {'id': z.get('id'), 'group_id': z.get('group_id', z.get('id')), 'points': z['points'],
+         'relative': z.get('relative', data.get('relative'))}
+        for z in entries if z.get('points')
+    ]
+
+
+def polygon_pixels(points, shape, relative=None):
+    """
+    Вершины полигона в пикселях кадра формы shape, массив (N, 1, 2) int32.
+    Без явного relative полигон считается относительным, только если все его координаты лежат в 0–1:
+    решение принимается для полигона целиком, а не для каждой координаты.
+    """
+    h, w = shape[:2]
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if relative is None:
+        relative = bool(np.all((pts >= 0) & (pts <= 1)))
+    if relative:
+        pts = pts * (w, h)
+    return pts.astype(np.int32).reshape(-1, 1, 2)
+
+
+class ZoneIndex:
+    """
+    Растр меток зон для кадра заданной формы: бит k пикселя установлен, если пиксель лежит в зоне k
+    (зоны могут пересекаться, до 32 на камеру). Бокс относится к зонам, в которых лежит его центр;
+    отнесение всех боксов кадра — одна векторная выборка из растра.
+    Полигон, все координаты которого лежат в 0–1, считается заданным относительно размера кадра
+    (см. polygon_pixels).
+    """
+    MAX_ZONES = 32
+
+    def __init__(self, zones, shape):
+        if len(zones) > self.MAX_ZONES:
+            raise RuntimeError(f"Too many zones: {len(zones)} > {self.MAX_ZONES}")
+        h, w = shape[:2]
+        self.shape = (h, w)
+        self.ids = [z['id'] for z in zones]
+        self.groups = [z['group_id'] for z in zones]
+        self.polygons = []
+        self._raster = np.zeros((h, w), dtype=np.uint32)
+        plane = np.zeros((h, w), dtype=np.uint8)
+        for k, z in enumerate(zones):
+            pts = polygon_pixels(z['points'], shape, z.get('relative'))
+            self.polygons.append(pts)
+            plane[:] = 0
+            cv2.fillPoly(plane, [pts], 1)
+            self._raster[plane > 0] |= np.uint32(1 << k)
+
+    def assign(self, boxes):
+        """Битовые маски зон для каждого бокса [x, y, w, h] (0 — бокс вне всех зон)."""
+        b = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        if len(b) == 0:
+            return np.zeros(0, dtype=np.uint32)
+        h, w = self.shape
+        cx = np.clip((b[:, 0] + b[:, 2] / 2).astype(np.int32), 0, w - 1)
+        cy = np.clip((b[:, 1] + b[:, 3] / 2).astype(np.int32), 0, h - 1)
+        return self._raster[cy, cx]
+
+    def counts(self, boxes, labels=None) -> dict:
+        """{zone_id: число машин}."""
+        labels = self.assign(boxes) if labels is None else labels
+        return {zone_id: int(np.count_nonzero(labels & np.uint32(1 << k)))
+                for k, zone_id in enumerate(self.ids)}
+
+    def group_counts(self, boxes, labels=None) -> dict:
+        """{group_id: число машин}; машина в нескольких зонах одной группы считается один раз."""
+        labels = self.assign(boxes) if labels is None else labels
+        result = {}
+        for group_id in dict.fromkeys(self.groups):
+            bits = 0
+            for k, g in enumerate(self.groups):
+                if g == group_id:
+                    bits |= 1 << k
+            result[group_id] = int(np.count_nonzero(labels & np.uint32(bits)))
+        return result
+
+    def inside(self, boxes, labels=None):
+        """Только боксы, центр которых лежит хотя бы в одной зоне."""
+        labels = self.assign(boxes) if labels is None else labels
+        return [box for box, label in zip(boxes, labels) if label]
+
+    def bounding_rect(self, margin: int = 0):
+        """
+        Ограничивающий прямоугольник (x, y, w, h) объединения всех зон, расширенный на margin пикселей
+        и обрезанный по кадру, или None, если зон нет.
+        """
+        if not self.polygons:
+            return None
+        x, y, w, h = cv2.boundingRect(np.concatenate(self.polygons).reshape(-1, 2))
+        fh, fw = self.shape
+        x0, y0 = max(x - margin, 0), max(y - margin, 0)
+        x1, y1 = min(x + w + margin, fw), min(y + h + margin, fh)
+        return (x0, y0, x1 - x0, y1 - y0) if x1 > x0 and y1 > y0 else None
+
+
+def zone_file_path(zone_dir: str, cam_id: str) -> str:
+    return os.path.join(zone_dir, f"zone_{cam_id}.yaml")
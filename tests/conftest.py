@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# модули сервиса импортируются плоско, как при запуске python src/...
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+# эталонные реализации из benchmarks/ (postprocess_reference)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
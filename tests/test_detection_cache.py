@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pytest
+
+from config import Config
+from detection_cache import DetectionCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _cache(tmp_path, **options):
+    cfg = Config(os.path.join(ROOT, 'config', 'default.json'))
+    # size_mb=0: таблица из probe слотов, окно поиска покрывает её целиком
+    cache = {'enabled': True, 'path': str(tmp_path / 'detections.bin'), 'size_mb': 0, 'max_boxes': 4, 'probe': 4}
+    cache.update(options)
+    return DetectionCache(cfg.override({'cache': cache}), b'fingerprint')
+
+
+def _frame(value):
+    return np.full((48, 64, 3), value, dtype=np.uint8)
+
+
+def test_put_get_round_trip_keeps_int_boxes(tmp_path):
+    cache = _cache(tmp_path)
+    key = cache.key(_frame(1), (0, 0, 64, 48))
+    boxes = [[10, 20, 30, 40], [1, 2, 3, 4]]
+    assert cache.get(key) is None
+    cache.put(key, boxes)
+    hit = cache.get(key)
+    assert hit == boxes
+    assert all(isinstance(v, int) for box in hit for v in box)
+    assert cache.key(_frame(1), (0, 0, 32, 48)) != key
+    cache.close()
+
+
+def test_shared_between_instances(tmp_path):
+    writer, reader = _cache(tmp_path), _cache(tmp_path)
+    key = writer.key(_frame(2))
+    writer.put(key, [[5, 6, 7, 8]])
+    assert reader.get(key) == [[5, 6, 7, 8]]
+    writer.close()
+    reader.close()
+
+
+def test_slot_being_written_is_not_read(tmp_path):
+    cache = _cache(tmp_path)
+    key = cache.key(_frame(3))
+    cache.put(key, [[1, 1, 1, 1]])
+    idx = next(i for i in range(cache.stats()['slots']) if bytes(cache._slots['key'][i]) == key)
+    # нечётная версия: писатель посреди перезаписи слота
+    cache._slots['version'][idx] += 1
+    assert cache.get(key) is None
+    cache._slots['version'][idx] += 1
+    assert cache.get(key) == [[1, 1, 1, 1]]
+    cache.close()
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = _cache(tmp_path)
+    keys = [cache.key(_frame(v)) for v in range(5)]
+    for i, key in enumerate(keys[:4]):
+        cache.put(key, [[i, i, i, i]])
+    cache.get(keys[0])
+    cache.put(keys[4], [[4, 4, 4, 4]])
+    assert cache.get(keys[1]) is None
+    assert [cache.get(k) for k in (keys[0], keys[2], keys[3], keys[4])] == \
+        [[[0, 0, 0, 0]], [[2, 2, 2, 2]], [[3, 3, 3, 3]], [[4, 4, 4, 4]]]
+    cache.close()
+
+
+def test_too_many_boxes_are_not_cached(tmp_path):
+    cache = _cache(tmp_path)
+    key = cache.key(_frame(4))
+    cache.put(key, [[0, 0, 1, 1]] * 5)
+    assert cache.get(key) is None
+    cache.close()
+
+
+def test_other_geometry_uses_its_own_file(tmp_path):
+    small, large = _cache(tmp_path), _cache(tmp_path, max_boxes=8)
+    key = small.key(_frame(5))
+    small.put(key, [[1, 2, 3, 4]])
+    assert large.get(key) is None
+    assert small.get(key) == [[1, 2, 3, 4]]
+    assert len(list(tmp_path.iterdir())) == 2
+    small.close()
+    large.close()
+
+
+def test_incompatible_file_is_not_truncated(tmp_path):
+    cache = _cache(tmp_path)
+    path = cache._path
+    cache.close()
+    with open(path, 'r+b') as f:
+        f.write(b'\0' * 8)
+    size = os.path.getsize(path)
+    with pytest.raises(RuntimeError):
+        _cache(tmp_path)
+    assert os.path.getsize(path) == size
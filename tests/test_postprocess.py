@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+from detector import postprocess_yolo
+from postprocess_reference import postprocess_loop, make_preds
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('conf, nms', [(0.25, 0.45), (0.5, 0.3)])
+def test_matches_loop(seed, conf, nms):
+    preds = make_preds(25200, seed)
+    shape = (1080, 1920)
+    ref = postprocess_loop(preds, shape, conf, nms)
+    assert ref
+    assert sorted(postprocess_yolo(preds, shape, conf, nms)) == sorted(ref)
+
+
+def test_no_confident_rows():
+    preds = np.zeros((1, 100, 85), dtype=np.float32)
+    assert postprocess_yolo(preds, (480, 640), 0.25, 0.45) == []
@@ -0,0 +1,26 @@
+import os
+
+from config import Config
+from video_capture import VideoCapture
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _capture():
+    cfg = Config(os.path.join(ROOT, 'config', 'default.json'))
+    # камеры не открываются; маски и зоны берутся из поставляемого masks/
+    return VideoCapture(cfg.override({
+        'cameras': None,
+        'mask_dir': os.path.join(ROOT, cfg.get('mask_dir')),
+        'zone_dir': os.path.join(ROOT, cfg.get('zone_dir')),
+    }))
+
+
+def test_zone_rect_of_shipped_zones_is_smaller_than_frame():
+    vc = _capture()
+    shape = (1080, 1920, 3)
+    for cam_id in ('1', '2', '3', '4'):
+        x, y, w, h = vc.zone_rect(cam_id, shape)
+        assert 0 <= x and 0 <= y and x + w <= shape[1] and y + h <= shape[0]
+        assert w * h < shape[0] * shape[1]
+
@@ -0,0 +1,33 @@
+from zones import ZoneIndex, polygon_pixels
+
+
+def test_pixel_polygon_with_unit_vertex_stays_absolute():
+    pts = polygon_pixels([[1, 1], [100, 1], [100, 100], [1, 100]], (200, 400))
+    assert pts.reshape(-1, 2).tolist() == [[1, 1], [100, 1], [100, 100], [1, 100]]
+
+
+def test_relative_polygon_scaled_to_frame():
+    pts = polygon_pixels([[0.5, 0], [1, 0], [1, 1], [0.5, 1]], (200, 400))
+    assert pts.reshape(-1, 2).tolist() == [[200, 0], [400, 0], [400, 200], [200, 200]]
+
+
+def test_explicit_relative_flag():
+    pts = polygon_pixels([[0, 0], [1, 1]], (200, 400), relative=False)
+    assert pts.reshape(-1, 2).tolist() == [[0, 0], [1, 1]]
+
+
+def test_group_counts_count_each_box_once():
+    index = ZoneIndex([{'id': 'a', 'group_id': 'g', 'points': [[0, 0], [0.6, 0], [0.6, 1], [0, 1]]},
+                       {'id': 'b', 'group_id': 'g', 'points': [[0.4, 0], [1, 0], [1, 1], [0.4, 1]]}],
+                      (100, 100))
+    boxes = [[45, 45, 10, 10], [10, 10, 5, 5]]
+    assert index.counts(boxes) == {'a': 2, 'b': 1}
+    assert index.group_counts(boxes) == {'g': 2}
+
+
+def test_bounding_rect_adds_margin_and_clips_to_frame():
+    index = ZoneIndex([{'id': 'a', 'group_id': 'g', 'points': [[10, 20], [50, 20], [50, 60], [10, 60]]},
+                       {'id': 'b', 'group_id': 'g', 'points': [[80, 70], [95, 70], [95, 90], [80, 90]]}],
+                      (100, 100))
+    assert index.bounding_rect() == (10, 20, 86, 71)
+    assert index.bounding_rect(15) == (0, 5, 100, 95)